@@ -1,13 +1,67 @@
 import base64
+import bz2
+import copy
+import hashlib
+import io
 import json
+import lzma
+import mmap
+import os
 import pickle
+import struct
+import tempfile
+import tracemalloc
+import zlib
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from itertools import zip_longest
+from threading import Lock, RLock, Thread
+from time import perf_counter
+
+
+def stat_key(path):
+    """Identify a version of a file by its inode, size and modification time"""
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+_MISSING = object()
+
+# Compression codecs for PickleStore, as functions to compress with a level
+# (None for the default) and to decompress
+CODECS = {
+    None: (lambda data, level: data, lambda data: data),
+    "zlib": (
+        lambda data, level: zlib.compress(data, -1 if level is None else level),
+        zlib.decompress,
+    ),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    "bz2": (
+        lambda data, level: bz2.compress(data, 9 if level is None else level),
+        bz2.decompress,
+    ),
+}
 
 
 class AbstractStorage(ABC):
-    def __init__(self, path):
+    # Whether load() returns data equal to what was passed to store()
+    lossless = False
+
+    def __init__(self, path, atomic=False):
+        """
+        In atomic mode, writes go to a temporary file that is renamed over the
+        path once it is complete, so a crash mid-write never leaves a half
+        written file behind. Binary stores read through mmap rather than
+        copying the file into memory, and verify() compares hashes of the
+        bytes rather than loading the file again.
+        """
         self.path = path
         self.type = None
+        self.atomic = atomic
+        # The stat of the file when it was last hashed, and its hash
+        self._digest = None
 
     @abstractmethod
     def store(self, data): ...
@@ -15,41 +69,715 @@ class AbstractStorage(ABC):
     @abstractmethod
     def load(self): ...
 
+    def dumps(self, data):
+        """Return the bytes store() would write for data, used by verify()"""
+        raise NotImplementedError
+
     def verify(self, data):
+        if self.atomic:
+            try:
+                expected = hashlib.sha256(self.dumps(data)).digest()
+            except NotImplementedError:
+                pass
+            else:
+                return expected == self.digest()
         return data == self.load()
 
+    def digest(self):
+        """Return the sha256 of the stored file, only rehashing it if it changed"""
+        key = stat_key(self.path)
+        if self._digest is None or self._digest[0] != key:
+            with self._open_read() as buffer:
+                self._digest = (key, hashlib.sha256(buffer).digest())
+        return self._digest[1]
+
+    @contextmanager
+    def _open_write(self):
+        """Open the path for writing in binary, atomically in atomic mode"""
+        if not self.atomic:
+            with open(self.path, "wb") as f:
+                yield f
+            return
+
+        fd, temp_path = self._make_temp()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _make_temp(self):
+        """Create a temporary file next to the path to be renamed over it"""
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.")
+
+        # mkstemp makes the file private, so give it the permissions the file
+        # it replaces had, or the ones a normal open() would give it
+        try:
+            mode = os.stat(self.path).st_mode & 0o777
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(temp_path, mode)
+        return fd, temp_path
+
+    @contextmanager
+    def _open_read(self):
+        """Yield the contents of the path, mapped rather than copied in atomic mode"""
+        with open(self.path, "rb") as f:
+            if self.atomic and os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    yield buffer
+            else:
+                yield f.read()
+
 
 class JsonStore(AbstractStorage):
+    def dumps(self, data):
+        return json.dumps(data).encode("utf-8")
+
     def store(self, data):
         self.type = type(data)
-        with open(self.path, "w") as f:
-            json.dump(data, f)
+        with self._open_write() as f:
+            text = io.TextIOWrapper(f, encoding="utf-8")
+            json.dump(data, text)
+            text.detach()
 
     def load(self):
-        with open(self.path, "r") as f:
+        with open(self.path, "r", encoding="utf-8") as f:
             return json.load(f)
 
 
 class PickleStore(AbstractStorage):
+    """
+    With the defaults this writes a plain pickle. Setting a codec compresses
+    it, and out_of_band uses pickle protocol 5 to write large buffers (like
+    bytearrays and NumPy arrays) straight to the file after the pickle rather
+    than copying them into it.
+
+    Either option switches to a framed format: a header with the codec and
+    number of sections, a table of the stored and original size of each
+    section, then the sections. The first section is the pickle and the rest
+    are its out of band buffers, each compressed on its own. load() tells the
+    formats apart by the header, so it reads both.
+    """
+
+    lossless = True
+
+    MAGIC = b"PKLZ"
+    HEADER = struct.Struct("<4sBI")
+    SECTION = struct.Struct("<QQ")
+
+    def __init__(self, path, atomic=False, codec=None, level=None, out_of_band=False):
+        super().__init__(path, atomic)
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}, expected one of {list(CODECS)}")
+        self.codec = codec
+        self.level = level
+        self.out_of_band = out_of_band
+
+    def _write(self, f, data):
+        if self.codec is None and not self.out_of_band:
+            pickle.dump(data, f)
+            return
+
+        buffers = []
+        stream = pickle.dumps(
+            data,
+            protocol=5,
+            buffer_callback=buffers.append if self.out_of_band else None,
+        )
+        sections = [stream, *(buffer.raw() for buffer in buffers)]
+
+        # Leave room for the section table, and fill it in once the stored
+        # sizes are known
+        compress = CODECS[self.codec][0]
+        start = f.tell()
+        f.write(b"\0" * (self.HEADER.size + self.SECTION.size * len(sections)))
+        table = []
+        for section in sections:
+            stored = compress(section, self.level)
+            f.write(stored)
+            table.append(self.SECTION.pack(len(stored), len(section)))
+
+        end = f.tell()
+        f.seek(start)
+        f.write(
+            self.HEADER.pack(self.MAGIC, list(CODECS).index(self.codec), len(sections))
+        )
+        f.write(b"".join(table))
+        f.seek(end)
+
+    def dumps(self, data):
+        f = io.BytesIO()
+        self._write(f, data)
+        return f.getvalue()
+
     def store(self, data):
         self.type = type(data)
-        with open(self.path, "wb") as f:
-            pickle.dump(data, f)
+        with self._open_write() as f:
+            self._write(f, data)
 
     def load(self):
         with open(self.path, "rb") as f:
-            return pickle.load(f)
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                f.seek(0)
+                with self._open_read() as buffer:
+                    return pickle.loads(buffer)
+
+            f.seek(0)
+            _, codec, count = self.HEADER.unpack(f.read(self.HEADER.size))
+            codec = list(CODECS)[codec]
+            table = [
+                self.SECTION.unpack(f.read(self.SECTION.size)) for _ in range(count)
+            ]
+
+            sections = []
+            for stored, size in table:
+                if codec is None:
+                    # Read straight into the buffer the unpickled object will use
+                    section = bytearray(size)
+                    f.readinto(section)
+                else:
+                    section = CODECS[codec][1](f.read(stored))
+                sections.append(section)
+
+        stream, *buffers = sections
+        return pickle.loads(stream, buffers=buffers)
 
 
 class Base64Store(AbstractStorage):
+    def dumps(self, data):
+        return base64.b64encode(str(data).encode("utf-8"))
+
     def store(self, data):
         self.type = type(data)
-        with open(self.path, "wb") as f:
-            f.write(base64.b64encode(str(data).encode("utf-8")))
+        with self._open_write() as f:
+            f.write(self.dumps(data))
 
     def load(self):
+        with self._open_read() as buffer:
+            return base64.b64decode(buffer).decode("utf-8")
+
+
+class JsonLinesStore(AbstractStorage):
+    """
+    Stores an iterable of records as JSON Lines, one record per line.
+
+    Records are encoded and written one at a time, and load_records() is a
+    generator that decodes them one line at a time, so neither side ever
+    holds more than one record in memory. load() returns them all as a list.
+    """
+
+    def _encode(self, record):
+        return json.dumps(record).encode("utf-8") + b"\n"
+
+    def store(self, data):
+        self.type = type(data)
+        with self._open_write() as f:
+            for record in data:
+                f.write(self._encode(record))
+
+    def load_records(self):
+        with open(self.path, "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def load(self):
+        return list(self.load_records())
+
+    def verify(self, data):
+        if self.atomic:
+            digest = hashlib.sha256()
+            for record in data:
+                digest.update(self._encode(record))
+            return digest.digest() == self.digest()
+        return all(
+            a == b
+            for a, b in zip_longest(data, self.load_records(), fillvalue=_MISSING)
+        )
+
+
+class ChunkedBase64Store(AbstractStorage):
+    """
+    Base64Store that encodes and decodes through a fixed size buffer.
+
+    As well as anything Base64Store takes, store() accepts bytes, a binary
+    file object or an iterator of bytes or str chunks, and load_chunks()
+    yields the decoded data a chunk at a time. Base64 turns every 3 bytes into
+    4 characters, so chunks are encoded in multiples of 3 bytes and decoded in
+    multiples of 4 characters, which lets the pieces join up exactly.
+    """
+
+    def __init__(self, path, atomic=False, chunk_size=3 * 64 * 1024):
+        super().__init__(path, atomic)
+        self.chunk_size = chunk_size - chunk_size % 3
+
+    def _chunks(self, data):
+        """Split anything store() accepts into chunks of bytes"""
+        if isinstance(data, str):
+            for start in range(0, len(data), self.chunk_size):
+                yield data[start : start + self.chunk_size].encode("utf-8")
+        elif isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data)
+            for start in range(0, len(view), self.chunk_size):
+                yield view[start : start + self.chunk_size]
+        elif hasattr(data, "read"):
+            while chunk := data.read(self.chunk_size):
+                yield chunk
+        elif isinstance(data, Iterator):
+            for chunk in data:
+                yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        else:
+            yield from self._chunks(str(data))
+
+    def store(self, data):
+        self.type = type(data)
+        with self._open_write() as f:
+            pending = b""
+            for chunk in self._chunks(data):
+                pending += chunk
+                usable = len(pending) - len(pending) % 3
+                if usable >= self.chunk_size:
+                    f.write(base64.b64encode(pending[:usable]))
+                    pending = pending[usable:]
+            f.write(base64.b64encode(pending))
+
+    def load_chunks(self):
+        """Yield the decoded data a chunk at a time"""
+        encoded_size = self.chunk_size // 3 * 4
         with open(self.path, "rb") as f:
-            return base64.b64decode(f.read()).decode("utf-8")
+            while chunk := f.read(encoded_size):
+                yield base64.b64decode(chunk)
+
+    def load(self):
+        return b"".join(self.load_chunks()).decode("utf-8")
+
+
+class _Superseded(Exception):
+    """Raised inside a LogStore compaction whose file has been replaced"""
+
+
+class LogStore(AbstractStorage):
+    """
+    A key value store kept as an append-only log of records.
+
+    Every put() or delete() appends a length prefixed record to the end of
+    the file, and an in memory index maps each key to where its latest value
+    is, so reads and writes never touch more than one record. Records that
+    have been overwritten or deleted are dead weight, and once they make up
+    more than compact_ratio of the file it is compacted in a background
+    thread by copying only the live records into a new file.
+
+    Each record is a header of a CRC, the record kind and the key and value
+    lengths, followed by the key and the pickled value. If the process dies
+    part way through appending, the torn record fails its CRC and is dropped
+    the next time the file is opened.
+    """
+
+    lossless = True
+
+    HEADER = struct.Struct("<IBII")
+    PUT = 0
+    DELETE = 1
+
+    def __init__(
+        self, path, atomic=False, compact_ratio=0.5, compact_min_bytes=1 << 20
+    ):
+        super().__init__(path, atomic)
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self.lock = RLock()
+        self.compaction = None
+        self.generation = 0
+        self._open()
+
+    def _open(self):
+        """Open the log and rebuild the index from it"""
+        # Lets a compaction tell if the file was replaced while it copied
+        self.generation += 1
+        # Held open for appends until close(), so it can't be a with block
+        self.file = open(self.path, "a+b")  # noqa: SIM115
+        self.index = {}
+        self.dead = 0
+        self.end = self._replay(self.file, 0, self.index)
+        # Anything after the last good record is a torn write, so drop it
+        self.file.truncate(self.end)
+
+    def _replay(self, f, start, index):
+        """
+        Read the records in f from start, updating index as they go.
+
+        Returns the offset of the end of the last complete record.
+        """
+        f.seek(start)
+        offset = start
+        while len(header := f.read(self.HEADER.size)) == self.HEADER.size:
+            crc, kind, key_length, value_length = self.HEADER.unpack(header)
+            body = f.read(key_length + value_length)
+            if len(body) != key_length + value_length or crc != zlib.crc32(
+                header[4:] + body
+            ):
+                break
+
+            key = body[:key_length].decode("utf-8")
+            size = self.HEADER.size + key_length + value_length
+            if key in index:
+                self.dead += index[key][2]
+            if kind == self.PUT:
+                index[key] = (
+                    offset + self.HEADER.size + key_length,
+                    value_length,
+                    size,
+                )
+            else:
+                index.pop(key, None)
+                self.dead += size
+            offset += size
+        return offset
+
+    def _record(self, kind, key, value=b""):
+        key = key.encode("utf-8")
+        header = self.HEADER.pack(0, kind, len(key), len(value))[4:]
+        crc = zlib.crc32(header + key + value)
+        return struct.pack("<I", crc) + header + key + value
+
+    def _append(self, kind, key, value=b""):
+        record = self._record(kind, key, value)
+        self.file.write(record)
+        self.file.flush()
+        offset = self.end
+        self.end += len(record)
+        return offset, len(record)
+
+    def put(self, key, value):
+        value = pickle.dumps(value)
+        with self.lock:
+            offset, size = self._append(self.PUT, key, value)
+            if key in self.index:
+                self.dead += self.index[key][2]
+            self.index[key] = (offset + size - len(value), len(value), size)
+            self._maybe_compact()
+
+    def delete(self, key):
+        with self.lock:
+            if key not in self.index:
+                raise KeyError(key)
+            _, size = self._append(self.DELETE, key)
+            self.dead += self.index.pop(key)[2] + size
+            self._maybe_compact()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.index:
+                return default
+            offset, length, _ = self.index[key]
+            self.file.seek(offset)
+            value = self.file.read(length)
+        return pickle.loads(value)
+
+    def scan(self):
+        """Yield every live key and value, reading one record at a time"""
+        with self.lock:
+            keys = list(self.index)
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is not _MISSING:
+                yield key, value
+
+    def store(self, data):
+        """Replace everything in the log with the items of a dict"""
+        self.type = type(data)
+        self.wait()
+        with self.lock:
+            self.file.close()
+            with self._open_write() as f:
+                for key, value in data.items():
+                    f.write(self._record(self.PUT, key, pickle.dumps(value)))
+            self._open()
+
+    def load(self):
+        return dict(self.scan())
+
+    def _maybe_compact(self):
+        if (
+            self.compaction is None
+            and self.end >= self.compact_min_bytes
+            and self.dead > self.end * self.compact_ratio
+        ):
+            self._start_compaction()
+
+    def _start_compaction(self):
+        """Start a background compaction, with the lock held"""
+        self.compaction = Thread(target=self._compact, daemon=True)
+        self.compaction.start()
+
+    def compact(self):
+        """
+        Compact the log now and wait for it to finish. If a compaction is
+        already running, wait for that one instead of starting another.
+        """
+        with self.lock:
+            if self.compaction is None:
+                self._start_compaction()
+            compaction = self.compaction
+        compaction.join()
+
+    def _compact(self):
+        """
+        Rewrite the log with only the live records.
+
+        The live records are copied without holding the lock, so reads and
+        writes carry on in the meantime. Anything appended while copying is
+        replayed onto the new file under the lock before it replaces the old.
+        If store() replaced the file in the meantime the copy is thrown away.
+        """
+        with self.lock:
+            live = dict(self.index)
+            end = self.end
+            generation = self.generation
+
+        fd, temp_path = self._make_temp()
+        try:
+            with open(self.path, "rb") as source, os.fdopen(fd, "w+b") as target:
+                for key, (offset, length, _) in live.items():
+                    source.seek(offset)
+                    target.write(self._record(self.PUT, key, source.read(length)))
+
+                with self.lock:
+                    if self.generation != generation:
+                        raise _Superseded
+                    # Copy over whatever was appended since the index was copied
+                    source.seek(end)
+                    target.write(source.read(self.end - end))
+                    target.flush()
+                    os.fsync(target.fileno())
+                    os.replace(temp_path, self.path)
+                    self.file.close()
+                    self._open()
+        except BaseException as e:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            if not isinstance(e, _Superseded):
+                raise
+        finally:
+            with self.lock:
+                self.compaction = None
+
+    def wait(self):
+        """Wait for a background compaction to finish"""
+        if (compaction := self.compaction) is not None:
+            compaction.join()
+
+    def close(self):
+        self.wait()
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LoadCache:
+    """
+    An LRU cache of loaded data, limited by number of entries and total size.
+
+    Entries are keyed by path and remember the stat_key() of the file they
+    were loaded from, so a file changed by anything else is a miss rather
+    than stale data. Sizes are measured as the size of the file on disk.
+    Cached values are shared, so treat them as read only.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, path, key):
+        """Return (True, value) if path is cached at version key, else (False, None)"""
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != key:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, path, key, value):
+        with self.lock:
+            self._remove(path)
+            size = key[1]
+            if size > self.max_bytes:
+                return
+            self.entries[path] = (key, value)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, path):
+        with self.lock:
+            self._remove(path)
+
+    def _remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.bytes -= entry[0][1]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+
+class CachedStore(AbstractStorage):
+    """
+    Wraps another store so load() reads through a LoadCache.
+
+    store() writes through to the wrapped store. If that store is lossless a
+    deep copy of the data is cached straight away, so later changes the caller
+    makes to its own object don't leak into load(). Otherwise the entry is
+    dropped so the next load() sees what was actually written. Pass the same
+    LoadCache to many CachedStores to share one set of limits between them.
+    """
+
+    def __init__(self, storage, cache=None):
+        super().__init__(storage.path, storage.atomic)
+        self.storage = storage
+        self.cache = cache if cache is not None else LoadCache()
+
+    def dumps(self, data):
+        return self.storage.dumps(data)
+
+    def store(self, data):
+        self.storage.store(data)
+        self.type = self.storage.type
+        if self.storage.lossless:
+            self.cache.put(self.path, stat_key(self.path), copy.deepcopy(data))
+        else:
+            self.cache.invalidate(self.path)
+
+    def load(self):
+        key = stat_key(self.path)
+        found, value = self.cache.get(self.path, key)
+        if not found:
+            value = self.storage.load()
+            self.cache.put(self.path, key, value)
+        return value
+
+
+def peak_memory(func, *args):
+    """Run func and return the peak memory Python allocated while it ran"""
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_codecs():
+    """Compare the size, write time and read time of each PickleStore codec"""
+    records = [
+        {"id": i, "name": f"user-{i}", "email": f"user-{i}@example.com", "score": i / 7}
+        for i in range(50_000)
+    ]
+    # Compressible but not trivially, like most real binary payloads
+    payload = bytearray(os.urandom(1024) * 4 * 1024)
+    payload[::7] = os.urandom(len(payload[::7]))
+    sample = {"records": records, "payload": payload}
+
+    options = [
+        (None, None, False),
+        (None, None, True),
+        ("zlib", 1, True),
+        ("zlib", 6, True),
+        ("bz2", 9, True),
+        ("lzma", 0, True),
+        ("lzma", 3, True),
+    ]
+    print("PickleStore codecs:")
+    print(
+        f"{'Codec':>6} {'Level':>5} {'Out of band':>11} {'Size':>10} {'Write':>9} {'Read':>9}"
+    )
+    for codec, level, out_of_band in options:
+        store = PickleStore(
+            "data.pickle", codec=codec, level=level, out_of_band=out_of_band
+        )
+
+        started_at = perf_counter()
+        store.store(sample)
+        write_time = perf_counter() - started_at
+
+        started_at = perf_counter()
+        store.load()
+        read_time = perf_counter() - started_at
+
+        size = os.path.getsize("data.pickle") / 1024 / 1024
+        print(
+            f"{codec!s:>6} {level!s:>5} {out_of_band!s:>11} {size:8.1f}MB "
+            f"{write_time * 1000:7.0f}ms {read_time * 1000:7.0f}ms"
+        )
+
+
+def benchmark_streaming(size=8 * 1024 * 1024):
+    """Compare the peak memory of the whole-object and streaming stores"""
+
+    def text_chunks():
+        for _ in range(size // 1024):
+            yield "x" * 1024
+
+    def records():
+        for i in range(size // 64):
+            yield {"id": i, "name": f"user-{i}"}
+
+    def exhaust(iterable):
+        for _ in iterable:
+            pass
+
+    b64, json_path, jsonl_path = "data.b64", "data.json", "data.jsonl"
+    cases = {
+        ("Base64Store", "store"): lambda: Base64Store(b64).store(
+            "".join(text_chunks())
+        ),
+        ("Base64Store", "load"): lambda: Base64Store(b64).load(),
+        ("ChunkedBase64Store", "store"): lambda: ChunkedBase64Store(b64).store(
+            text_chunks()
+        ),
+        ("ChunkedBase64Store", "load"): lambda: exhaust(
+            ChunkedBase64Store(b64).load_chunks()
+        ),
+        ("JsonStore", "store"): lambda: JsonStore(json_path).store(list(records())),
+        ("JsonStore", "load"): lambda: JsonStore(json_path).load(),
+        ("JsonLinesStore", "store"): lambda: JsonLinesStore(jsonl_path).store(
+            records()
+        ),
+        ("JsonLinesStore", "load"): lambda: exhaust(
+            JsonLinesStore(jsonl_path).load_records()
+        ),
+    }
+    print(f"Peak memory for {size / 1024 / 1024:.0f}MB of data:")
+    for (name, operation), case in cases.items():
+        print(f"{name:>20} {operation:<5} {peak_memory(case) / 1024 / 1024:8.1f}MB")
 
 
 data = {
@@ -81,3 +809,55 @@ bstore.store(data)
 bstore.verify(data)
 print(bstore.load())
 print(type(bstore.load()))
+
+# Atomic mode: writes are all or nothing, reads are mapped and verify() only
+# compares hashes
+for store in (
+    JsonStore("data.json", atomic=True),
+    PickleStore("data.pickle", atomic=True),
+    Base64Store("data.b64", atomic=True),
+):
+    store.store(data)
+    print(f"{type(store).__name__}: {store.verify(data)=}, {store.verify({})=}")
+
+# Read-through caching: repeated loads come from memory until the file changes
+cache = LoadCache(max_entries=2)
+cached_stores = [
+    CachedStore(PickleStore("data.pickle"), cache),
+    CachedStore(JsonStore("data.json"), cache),
+]
+for store in cached_stores:
+    store.store(data)
+for _ in range(3):
+    for store in cached_stores:
+        store.load()
+print(cache.stats())
+
+# Changing the file behind the cache's back is picked up on the next load
+JsonStore("data.json").store({**data, "age": 31})
+print(cached_stores[1].load()["age"])
+
+# As is going over the entry limit
+cached_b64 = CachedStore(Base64Store("data.b64"), cache)
+cached_b64.store(data)
+cached_b64.load()
+print(cache.stats())
+
+# An append-only log: only the changed key is written, not the whole dict
+with LogStore("data.log", compact_min_bytes=0) as lstore:
+    lstore.store(data)
+    lstore.put("age", 31)
+    lstore.delete("phone")
+    expected = {**data, "age": 31}
+    del expected["phone"]
+    print(lstore.get("age"), lstore.get("phone"), lstore.verify(expected))
+    for i in range(100):
+        lstore.put("counter", i)
+    lstore.wait()
+    print(f"{os.path.getsize('data.log')=}, {dict(lstore.scan())['counter']=}")
+
+# Streaming stores keep memory flat however big the data is
+benchmark_streaming()
+
+# Compressed and out of band pickles
+benchmark_codecs()
@@ -1,6 +1,18 @@
 import asyncio
+import contextvars
+import functools
+import inspect
+import sys
+import threading
 import time
-from time import perf_counter
+import tracemalloc
+import warnings
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic, perf_counter
+from typing import Any
 
 from tqdm.asyncio import tqdm
 
@@ -25,6 +37,227 @@ def blocking_action(wait: int | float = 0.2) -> None:
     time.sleep(wait)
 
 
+class TokenBucket:
+    """
+    Allows rate acquisitions per second on average, with bursts of up to
+    capacity at once after a quiet spell.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def amap(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    concurrency: int = 10,
+    rate: float | None = None,
+    executor: Executor | None = None,
+    ordered: bool = True,
+) -> AsyncIterator[Any]:
+    """
+    Yield func(item) for each item, with at most concurrency calls running.
+
+    Unlike gathering a to_thread() per item, tasks are only created as
+    earlier ones finish, so memory depends on concurrency rather than on how
+    many items there are. Plain functions run on executor, which by default is
+    a ThreadPoolExecutor with a thread per concurrent call, so they don't
+    compete with anything else using the loop's default executor. Coroutine
+    functions are awaited on the loop.
+
+    rate caps how many calls start per second. With ordered results come back
+    in the order of items, so a slow call holds up the ones after it,
+    otherwise they come back as they complete.
+    """
+    owns_executor = executor is None and not inspect.iscoroutinefunction(func)
+    if owns_executor:
+        executor = ThreadPoolExecutor(concurrency)
+    bucket = TokenBucket(rate) if rate else None
+    loop = asyncio.get_running_loop()
+
+    async def call(item: Any) -> Any:
+        if bucket:
+            await bucket.acquire()
+        if inspect.iscoroutinefunction(func):
+            return await func(item)
+        # Copy the context over like to_thread() does
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(executor, ctx.run, func, item)
+
+    pending = deque() if ordered else set()
+    try:
+        for item in items:
+            if len(pending) >= concurrency:
+                if ordered:
+                    yield await pending.popleft()
+                else:
+                    done, pending = await asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        yield task.result()
+            task = asyncio.create_task(call(item))
+            if ordered:
+                pending.append(task)
+            else:
+                pending.add(task)
+
+        while pending:
+            if ordered:
+                yield await pending.popleft()
+            else:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if owns_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def bounded_gather(
+    func: Callable[[Any], Any], items: Iterable[Any], **kwargs
+) -> list:
+    """Like gather() over func(item) for every item, but bounded like amap()"""
+    return [result async for result in amap(func, items, **kwargs)]
+
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str, max_workers: int | None = None) -> ThreadPoolExecutor:
+    """
+    Return the executor called name, creating it on first use. max_workers
+    only has an effect on that first call.
+    """
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+        return _executors[name]
+
+
+@dataclass
+class OffloadStats:
+    calls: int = 0
+    wait_sec: float = 0.0
+    run_sec: float = 0.0
+    max_wait_sec: float = 0.0
+    max_lag_sec: float = 0.0
+
+
+# OffloadStats for every @offload function, by module and qualified name
+offload_stats: dict[str, OffloadStats] = {}
+
+
+def offload(
+    executor: str = "offload", max_workers: int | None = None, warn_after: float = 0.1
+):
+    """
+    Turn a blocking function into a coroutine function that runs it on the
+    named executor from get_executor().
+
+    For every call the time spent waiting for a free thread is recorded
+    separately from the time the function ran for, so a starved executor
+    shows up as wait rather than as a slow function. Once the function
+    returns, the time until the awaiting coroutine resumes is how long the
+    event loop was kept busy by something else, and a warning is raised if
+    that is longer than warn_after seconds. The warning points at the line
+    that called the function, which by the time it is awaited may be inside
+    asyncio.gather() or a task rather than the caller.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        name = f"{func.__module__}.{func.__qualname__}"
+        stats = offload_stats.setdefault(name, OffloadStats())
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Where the coroutine was made, not where it is first awaited
+            caller = sys._getframe(1)
+            return run(
+                caller.f_code.co_filename,
+                caller.f_lineno,
+                caller.f_globals,
+                args,
+                kwargs,
+            )
+
+        async def run(filename, lineno, caller_globals, args, kwargs):
+            loop = asyncio.get_running_loop()
+            ctx = contextvars.copy_context()
+            times = []
+
+            def timed():
+                times.append(perf_counter())
+                try:
+                    return ctx.run(func, *args, **kwargs)
+                finally:
+                    times.append(perf_counter())
+
+            submitted_at = perf_counter()
+            try:
+                pool = get_executor(executor, max_workers)
+                return await loop.run_in_executor(pool, timed)
+            finally:
+                if len(times) == 2:
+                    started_at, finished_at = times
+                    wait, lag = started_at - submitted_at, perf_counter() - finished_at
+                    stats.calls += 1
+                    stats.wait_sec += wait
+                    stats.run_sec += finished_at - started_at
+                    stats.max_wait_sec = max(stats.max_wait_sec, wait)
+                    stats.max_lag_sec = max(stats.max_lag_sec, lag)
+                    if lag > warn_after:
+                        warnings.warn_explicit(
+                            f"Event loop was blocked for {lag:.2f}s "
+                            f"before {name} could return",
+                            RuntimeWarning,
+                            filename,
+                            lineno,
+                            module=caller_globals.get("__name__"),
+                            registry=caller_globals.setdefault(
+                                "__warningregistry__", {}
+                            ),
+                        )
+
+        return inspect.markcoroutinefunction(wrapper)
+
+    return decorator
+
+
+def print_offload_stats() -> None:
+    for name, stats in offload_stats.items():
+        if stats.calls:
+            print(
+                f"{name}: {stats.calls} calls, "
+                f"avg wait {stats.wait_sec / stats.calls:.3f}s, "
+                f"avg run {stats.run_sec / stats.calls:.3f}s, "
+                f"max wait {stats.max_wait_sec:.3f}s, "
+                f"max loop lag {stats.max_lag_sec:.3f}s"
+            )
+
+
 async def main() -> None:
     items = [i for i in range(0, 5)]
 
@@ -59,6 +292,209 @@ async def main() -> None:
     elapsed = perf_counter() - started_at
     print(f"Asyncronous time with tqdm: {elapsed:.2f}")
 
+    """
+    Bounded concurrency:
+
+    Gathering one to_thread() per item creates every task up front and
+    queues them all on the default executor. bounded_gather() keeps only
+    concurrency of them alive, so the memory stays flat however many
+    items there are.
+    """
+    items = [0.01] * 2000
+    runs = {"gather all": None, **{f"bounded {c}": c for c in (10, 100, 500)}}
+    for name, concurrency in runs.items():
+        tracemalloc.start()
+        started_at = perf_counter()
+        if concurrency is None:
+            await asyncio.gather(
+                *[asyncio.to_thread(blocking_action, i) for i in items]
+            )
+        else:
+            await bounded_gather(blocking_action, items, concurrency=concurrency)
+        elapsed = perf_counter() - started_at
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(
+            f"{name}: {elapsed:.2f}s, {len(items) / elapsed:.0f} items/s, "
+            f"peak memory {peak / 1024:.0f} KiB"
+        )
+
+
+# Marks the end of the items on a pipeline queue
+DONE = object()
+
+
+@dataclass
+class Stage:
+    """
+    One step of a Pipeline. func may be a coroutine function or a plain
+    function, and up to concurrency items are passed through it at once.
+    Set blocking for plain functions that block, like blocking_action, so
+    they run on the pipeline's executor instead of on the event loop.
+    """
+
+    func: Callable[[Any], Any]
+    concurrency: int = 1
+    blocking: bool = False
+    maxsize: int = 100
+
+
+class Pipeline:
+    """
+    Stages connected by bounded asyncio.Queues.
+
+    Each stage runs concurrency worker tasks that take items from the queue
+    before it and put their results on the queue after it. The queues are
+    bounded, so a slow stage holds up the ones before it rather than letting
+    items pile up in memory. Blocking stages share one executor, by default a
+    ThreadPoolExecutor with a thread for each of their workers.
+
+    If any stage raises, every worker is cancelled and the first error is
+    raised from stream(). To stop early, iterate over stream() inside
+    contextlib.aclosing() so the workers are cancelled straight away rather
+    than when the generator is garbage collected.
+    """
+
+    def __init__(self, *stages: Stage, executor: Executor | None = None):
+        self.stages = stages
+        self.executor = executor
+
+    async def _call(self, stage: Stage, item: Any, executor: Executor) -> Any:
+        if stage.blocking:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, stage.func, item)
+        if inspect.iscoroutinefunction(stage.func):
+            return await stage.func(item)
+        return stage.func(item)
+
+    async def _work(
+        self,
+        stage: Stage,
+        inbox: asyncio.Queue,
+        outbox: asyncio.Queue,
+        executor: Executor,
+    ):
+        while (item := await inbox.get()) is not DONE:
+            await outbox.put(await self._call(stage, item, executor))
+        # Leave the marker for the other workers on this stage
+        await inbox.put(DONE)
+
+    async def _run_stage(
+        self,
+        stage: Stage,
+        inbox: asyncio.Queue,
+        outbox: asyncio.Queue,
+        executor: Executor,
+    ):
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(stage.concurrency):
+                tg.create_task(self._work(stage, inbox, outbox, executor))
+        await outbox.put(DONE)
+
+    async def _feed(self, items: Iterable | AsyncIterable, queue: asyncio.Queue):
+        if isinstance(items, AsyncIterable):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+        await queue.put(DONE)
+
+    async def _supervise(
+        self, items: Iterable | AsyncIterable, queues: list, executor: Executor
+    ):
+        """
+        Run the feeder and every stage, then mark the end of the output.
+        Returns the error that stopped them, if any.
+        """
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._feed(items, queues[0]))
+                for stage, inbox, outbox in zip(self.stages, queues, queues[1:]):
+                    tg.create_task(self._run_stage(stage, inbox, outbox, executor))
+        except* Exception as group:
+            error = group
+            while isinstance(error, ExceptionGroup):
+                error = error.exceptions[0]
+        else:
+            error = None
+        await queues[-1].put(DONE)
+        return error
+
+    async def stream(self, items: Iterable | AsyncIterable) -> AsyncIterator[Any]:
+        """Yield the output of the last stage as it is produced"""
+        # An executor made here is only this stream's, so streams running at
+        # once on the same Pipeline don't shut down each other's
+        executor = self.executor
+        owns_executor = executor is None
+        if owns_executor:
+            workers = sum(s.concurrency for s in self.stages if s.blocking)
+            executor = ThreadPoolExecutor(max(workers, 1))
+
+        queues = [asyncio.Queue(s.maxsize) for s in self.stages]
+        queues.append(asyncio.Queue(self.stages[-1].maxsize))
+        supervisor = asyncio.create_task(self._supervise(items, queues, executor))
+        try:
+            while (item := await queues[-1].get()) is not DONE:
+                yield item
+            if error := await supervisor:
+                raise error
+        finally:
+            supervisor.cancel()
+            await asyncio.gather(supervisor, return_exceptions=True)
+            if owns_executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, items: Iterable | AsyncIterable) -> list:
+        return [item async for item in self.stream(items)]
+
+
+async def pipeline_example() -> None:
+    """
+    Push a thousand items through a blocking fetch, then an async parse,
+    with a few hundred of them in flight at once on a single event loop.
+    """
+
+    def fetch(i: int) -> int:
+        blocking_action(0.05)
+        return i
+
+    async def parse(i: int) -> int:
+        await asyncio.sleep(0.01)
+        return i * 2
+
+    pipeline = Pipeline(
+        Stage(fetch, concurrency=100, blocking=True),
+        Stage(parse, concurrency=20),
+        Stage(str),
+    )
+
+    print("Running pipeline:")
+    items = range(1000)
+    started_at = perf_counter()
+    results = await pipeline.run(items)
+    elapsed = perf_counter() - started_at
+    print(f"Pipeline time: {elapsed:.2f}, {len(results) / elapsed:.0f} items/s")
+
+
+async def offload_example() -> None:
+    """
+    Twenty calls on an executor of four threads spend most of their time
+    waiting, and a coroutine that sleeps without awaiting blocks the loop
+    long enough to trigger the warning.
+    """
+    slow_sdk_call = offload("sdk", max_workers=4)(blocking_action)
+
+    async def hog_the_loop() -> None:
+        await asyncio.sleep(0.05)
+        time.sleep(0.3)
+
+    print("Running offloaded calls:")
+    await asyncio.gather(*[slow_sdk_call(0.1) for _ in range(20)], hog_the_loop())
+    print_offload_stats()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
+    asyncio.run(pipeline_example())
+    asyncio.run(offload_example())
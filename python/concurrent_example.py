@@ -1,9 +1,23 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from dataclasses import dataclass, field
+from itertools import islice
 from math import sqrt
+from os import process_cpu_count
 from random import random
-from time import sleep
-from typing import Any
+from statistics import quantiles
+from time import perf_counter, sleep, thread_time
+from typing import Any, Literal
+
+from tabulate import tabulate
 
 type number = float | int
 
@@ -22,6 +36,8 @@ class Result:
     args: Any
     result: Any | None = None
     err: Exception | None = None
+    attempts: int = 1
+    latency: float | None = None
 
 
 def do_task_result(t: number) -> Result:
@@ -79,6 +95,113 @@ def one_line_example(tasks: list[float]) -> None:
     print("\nResults:", results)
 
 
+@dataclass
+class Stats:
+    """
+    Running stats for bounded_map().
+
+    Only counters and the most recent latencies are kept, so memory stays the
+    same however many tasks run.
+    """
+
+    started_at: float = field(default_factory=perf_counter)
+    completed: int = 0
+    failed: int = 0
+    retries: int = 0
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=10_000))
+
+    def record(self, result: Result) -> None:
+        self.completed += 1
+        self.failed += result.err is not None
+        self.retries += result.attempts - 1
+        if result.latency is not None:
+            self.latencies.append(result.latency)
+
+    @property
+    def throughput(self) -> float:
+        """Tasks completed per second"""
+        return self.completed / (perf_counter() - self.started_at)
+
+    def __str__(self) -> str:
+        summary = (
+            f"{self.completed} tasks, {self.failed} failed, {self.retries} retries, "
+            f"{self.throughput:.2f} tasks/s"
+        )
+        if len(self.latencies) > 1:
+            cuts = quantiles(self.latencies, n=100)
+            summary += f", p50 {cuts[49]:.2f}s, p95 {cuts[94]:.2f}s"
+        return summary
+
+
+def with_retries(
+    func: Callable[[Any], Result], arg: Any, retries: int, backoff: float
+) -> Result:
+    """
+    Call func until it returns a Result without an error, or it has been
+    retried retries times. The wait between attempts doubles each time.
+    """
+    started_at = perf_counter()
+    for attempt in range(1, retries + 2):
+        result = func(arg)
+        if result.err is None or attempt > retries:
+            break
+        sleep(backoff * 2 ** (attempt - 1))
+
+    result.attempts = attempt
+    result.latency = perf_counter() - started_at
+    return result
+
+
+def bounded_map(
+    func: Callable[[Any], Result],
+    tasks: Iterable[Any],
+    max_in_flight: int = 8,
+    retries: int = 2,
+    backoff: float = 0.1,
+    stats: Stats | None = None,
+) -> Iterator[Result]:
+    """
+    Run func over tasks with at most max_in_flight running at once.
+
+    Unlike submitting everything up front, tasks are only pulled from the
+    iterable when there is room for them, so there are never more than
+    max_in_flight Futures alive and tasks can be an endless generator.
+    Results are yielded in the order they complete, and if a stats object is
+    passed in it is updated as they do.
+    """
+    tasks = iter(tasks)
+    with ThreadPoolExecutor(max_in_flight) as exe:
+
+        def submit(arg: Any) -> Future[Result]:
+            return exe.submit(with_retries, func, arg, retries, backoff)
+
+        pending = {submit(t) for t in islice(tasks, max_in_flight)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if stats is not None:
+                    stats.record(result)
+                yield result
+            pending.update(submit(t) for t in islice(tasks, len(done)))
+
+
+def bounded_example(tasks: Iterable[float]) -> None:
+    """
+    The tasks can be a generator, even a huge one, as they are only pulled in
+    as earlier ones finish. Failed tasks are retried with backoff before their
+    Result is given up on.
+    """
+    stats = Stats()
+    for res in bounded_map(do_task_result, tasks, max_in_flight=4, stats=stats):
+        print(
+            f"sqrt({res.args:.2f})={res.result if res.result else res.err} "
+            f"after {res.attempts} attempts"
+        )
+
+    print(f"\nStats: {stats}")
+
+
 def one_line_example_with_result(tasks) -> None:
     with ThreadPoolExecutor() as exe:
         results = list(exe.map(do_task_result, tasks))
@@ -87,8 +210,164 @@ def one_line_example_with_result(tasks) -> None:
         print(f"sqrt({res.args})={res.result if res.result else res.err}")
 
 
+def io_task(t: number) -> number:
+    """do_task without the printing or the random failures"""
+    sleep(t)
+    return sqrt(t)
+
+
+def cpu_task(n: int) -> number:
+    """All CPU and no sleeping, so threads can't run it in parallel"""
+    return sum(sqrt(i) for i in range(n))
+
+
+def timed(func: Callable[[Any], Any], arg: Any) -> tuple[Any, float, float]:
+    """Return func(arg) with the wall and CPU time the call took"""
+    wall_start, cpu_start = perf_counter(), thread_time()
+    result = func(arg)
+    return result, perf_counter() - wall_start, thread_time() - cpu_start
+
+
+type Kind = Literal["auto", "thread", "process"]
+
+
+class Executor:
+    """
+    Facade over a thread pool and a process pool, each created on first use.
+
+    map() runs a function on whichever pool kind says. With kind="auto" the
+    first sample_size items are run one at a time and timed: if they spent at
+    least cpu_ratio of their wall time on the CPU the GIL would serialise them,
+    so the rest go to the process pool, otherwise they stay on threads. The
+    choice is remembered per function. Items sent to processes are dispatched
+    in chunks so each pickle round trip carries many items rather than one.
+    """
+
+    def __init__(
+        self,
+        max_threads: int | None = None,
+        max_processes: int | None = None,
+        sample_size: int = 4,
+        cpu_ratio: float = 0.5,
+    ) -> None:
+        self.max_threads = max_threads
+        self.max_processes = max_processes or process_cpu_count() or 1
+        self.sample_size = sample_size
+        self.cpu_ratio = cpu_ratio
+        self.kinds: dict[Callable, Kind] = {}
+        self._threads: ThreadPoolExecutor | None = None
+        self._processes: ProcessPoolExecutor | None = None
+
+    @property
+    def threads(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.max_threads)
+        return self._threads
+
+    @property
+    def processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            self._processes = ProcessPoolExecutor(self.max_processes)
+        return self._processes
+
+    def profile(self, func: Callable[[Any], Any], sample: list) -> tuple[Kind, list]:
+        """
+        Run the sample and decide which pool suits func. The sample's results
+        are returned too so they don't have to be run again.
+
+        The items are run one after another on a single thread, because
+        threads running at the same time wait on each other for the GIL, and
+        that wait counts as wall time but not CPU time.
+        """
+        runs = [timed(func, item) for item in sample]
+        wall = sum(w for _, w, _ in runs)
+        cpu = sum(c for _, _, c in runs)
+        kind = "process" if wall and cpu / wall >= self.cpu_ratio else "thread"
+        return kind, [r for r, _, _ in runs]
+
+    def map(
+        self,
+        func: Callable[[Any], Any],
+        items: Iterable[Any],
+        kind: Kind = "auto",
+        chunksize: int | None = None,
+    ) -> list:
+        """
+        Return [func(i) for i in items], in order. chunksize only applies to
+        the process pool and by default splits the items into about four
+        chunks per process.
+        """
+        items = list(items)
+        results = []
+        if kind == "auto":
+            kind = self.kinds.get(func)
+            if kind is None:
+                kind, results = self.profile(func, items[: self.sample_size])
+                self.kinds[func] = kind
+                items = items[len(results) :]
+
+        if kind == "thread":
+            results.extend(self.threads.map(func, items))
+        elif kind == "process":
+            if chunksize is None:
+                chunksize = max(1, len(items) // (self.max_processes * 4))
+            results.extend(self.processes.map(func, items, chunksize=chunksize))
+        else:
+            raise ValueError(f"Unknown executor kind {kind!r}")
+        return results
+
+    def shutdown(self) -> None:
+        for pool in (self._threads, self._processes):
+            if pool is not None:
+                pool.shutdown()
+        self._threads = self._processes = None
+
+    def __enter__(self) -> "Executor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+
+
+def benchmark_executors() -> None:
+    """
+    Compare threads, unchunked processes and chunked processes on an I/O bound
+    and a CPU bound workload, along with whatever kind="auto" picks. The pools
+    are warmed up first so process start up isn't counted against them.
+    """
+    workloads = {
+        "I/O bound": (io_task, [0.01] * 200),
+        "CPU bound, short": (cpu_task, [20_000] * 400),
+        "CPU bound, long": (cpu_task, [2_000_000] * 8),
+    }
+    modes = {
+        "thread": {"kind": "thread"},
+        "process": {"kind": "process", "chunksize": 1},
+        "chunked process": {"kind": "process"},
+        "auto": {"kind": "auto"},
+    }
+
+    rows = []
+    with Executor(max_threads=32) as exe:
+        exe.threads.submit(int).result()
+        exe.processes.submit(int).result()
+        for name, (func, items) in workloads.items():
+            # Both CPU workloads use cpu_task, so profile each one afresh
+            exe.kinds.pop(func, None)
+            timings = []
+            for options in modes.values():
+                start = perf_counter()
+                exe.map(func, items, **options)
+                timings.append(f"{perf_counter() - start:.3f}s")
+            rows.append([name, *timings, exe.kinds[func]])
+
+    print(tabulate(rows, headers=["Workload", *modes, "Auto picked"]))
+
+
 if __name__ == "__main__":
     tasks = [random() * 10 for _ in range(10)]
     # full_example(tasks)
     # one_line_example(tasks)
     one_line_example_with_result(tasks)
+    # bounded_example(random() for _ in range(20))
+    # benchmark_executors()
@@ -0,0 +1,212 @@
+import json
+import os
+import tomllib
+from collections.abc import Callable, Iterator, Mapping
+from pathlib import Path
+from threading import Lock
+from types import MappingProxyType
+from typing import Any, Protocol
+
+"""
+Layered config sources for env_var_parser and env_var_parser_dataclass.
+
+Each source turns somewhere config can live into a flat dict of strings, the
+same shape as os.environ, so the parsers don't need to know where a value
+came from. LayeredConfig merges them, with later sources overriding earlier
+ones, e.g. defaults in a JSON file, then a mounted .env file, then the real
+environment.
+"""
+
+
+class Source(Protocol):
+    def version(self) -> Any:
+        """Something cheap to compare that changes whenever read() would"""
+        ...
+
+    def read(self) -> dict[str, str]: ...
+
+
+class EnvSource:
+    """
+    The process environment. Its version is a copy of it, which read() then
+    hands back rather than copying it again.
+    """
+
+    def __init__(self, environ: Mapping[str, str] = os.environ):
+        self.environ = environ
+        self._copy: dict[str, str] = {}
+
+    def version(self) -> dict[str, str]:
+        self._copy = dict(self.environ)
+        return self._copy
+
+    def read(self) -> dict[str, str]:
+        return self._copy
+
+
+def _flatten(data: Mapping, prefix: str = "") -> dict[str, str]:
+    """
+    Flatten nested tables into prefix_key names and turn values into the
+    strings an env var would hold, with lists comma separated.
+    """
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, Mapping):
+            flat |= _flatten(value, f"{prefix}{key}_")
+        elif isinstance(value, bool):
+            flat[prefix + key] = "true" if value else "false"
+        elif isinstance(value, list):
+            flat[prefix + key] = ",".join(str(v) for v in value)
+        else:
+            flat[prefix + key] = "" if value is None else str(value)
+    return flat
+
+
+def parse_dotenv(text: str) -> dict[str, str]:
+    """Parse KEY=value lines, skipping blanks and comments"""
+    values = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.removeprefix("export ").split("=", 1)
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+            value = value[1:-1]
+        values[key.strip()] = value
+    return values
+
+
+# (path, parser) -> ((mtime, size, inode), parsed values), shared by every FileSource
+_parsed_files: dict[tuple[Path, Callable], tuple[tuple, dict[str, str]]] = {}
+
+
+class FileSource:
+    """
+    A config file, parsed with parse into a flat dict. A missing file counts
+    as empty, so optional files can be listed.
+
+    Parsed files are cached by mtime, size and inode, so however many
+    LayeredConfigs list the same file it is only read again after it changes.
+    The inode catches files swapped in by a rename or a symlink change, as
+    Kubernetes does for mounted ConfigMaps, even when the new file has the
+    same size and timestamp. An in-place edit that keeps the size, within
+    one tick of the filesystem's clock, can still be missed.
+    """
+
+    def __init__(self, path: str | Path, parse: Callable[[str], dict[str, str]]):
+        self.path = Path(path)
+        self.parse = parse
+
+    def version(self) -> tuple | None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def read(self) -> dict[str, str]:
+        version = self.version()
+        if version is None:
+            return {}
+        cached = _parsed_files.get((self.path, self.parse))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        values = self.parse(self.path.read_text())
+        _parsed_files[(self.path, self.parse)] = (version, values)
+        return values
+
+
+def _parse_json(text: str) -> dict[str, str]:
+    return _flatten(json.loads(text))
+
+
+def _parse_toml(text: str) -> dict[str, str]:
+    return _flatten(tomllib.loads(text))
+
+
+class DotEnvSource(FileSource):
+    def __init__(self, path: str | Path):
+        super().__init__(path, parse_dotenv)
+
+
+class JsonSource(FileSource):
+    def __init__(self, path: str | Path):
+        super().__init__(path, _parse_json)
+
+
+class TomlSource(FileSource):
+    def __init__(self, path: str | Path):
+        super().__init__(path, _parse_toml)
+
+
+class LayeredConfig(Mapping[str, str]):
+    """
+    The merge of several sources, later ones overriding earlier ones.
+
+    snapshot is a read-only mapping that is replaced as a whole, never
+    changed in place, so it can be read from any thread without a lock.
+    LayeredConfig is itself a Mapping over the current snapshot, so it can
+    be passed to the parsers in place of os.environ.
+
+    refresh() only reads the sources whose version has changed and only
+    builds a new snapshot if one of them has.
+    """
+
+    def __init__(self, *sources: Source):
+        self.sources = sources
+        self.snapshot: Mapping[str, str] = MappingProxyType({})
+        self._versions: list[Any] = [object()] * len(sources)
+        self._layers: list[dict[str, str]] = [{}] * len(sources)
+        self._lock = Lock()
+        self.refresh()
+
+    def refresh(self) -> bool:
+        """Re-read changed sources and return whether anything changed"""
+        with self._lock:
+            changed = False
+            for i, source in enumerate(self.sources):
+                version = source.version()
+                if version != self._versions[i]:
+                    self._versions[i] = version
+                    self._layers[i] = source.read()
+                    changed = True
+
+            if changed:
+                merged = {}
+                for layer in self._layers:
+                    merged |= layer
+                self.snapshot = MappingProxyType(merged)
+            return changed
+
+    def __getitem__(self, key: str) -> str:
+        return self.snapshot[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.snapshot)
+
+    def __len__(self) -> int:
+        return len(self.snapshot)
+
+
+if __name__ == "__main__":
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory() as tmp:
+        defaults, dotenv = Path(tmp, "defaults.toml"), Path(tmp, ".env")
+        defaults.write_text('name = "app"\nport = 8000\n[db]\nhost = "db"\n')
+        dotenv.write_text("# mounted config\nport=9000\n")
+
+        config = LayeredConfig(
+            TomlSource(defaults), DotEnvSource(dotenv), EnvSource({"debug": "1"})
+        )
+        print(dict(config.snapshot))
+        assert config["port"] == "9000" and config["db_host"] == "db"
+
+        # Nothing has changed, so nothing is read again
+        assert not config.refresh()
+
+        # Swap in a new file of the same size, the way deploys usually do
+        Path(tmp, ".env.new").write_text("port=9001\n")
+        os.replace(Path(tmp, ".env.new"), dotenv)
+        assert config.refresh() and config["port"] == "9001"
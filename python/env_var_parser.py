@@ -1,31 +1,41 @@
 import os
+from collections.abc import Mapping
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import Any
 
+from config_sources import EnvSource, JsonSource, LayeredConfig
+
 """
 Parse environment variables.
 """
 
 
 def parse_env_vars(
-    required: list[str] | None = None, optional: dict[str, str | None] | None = None
+    required: list[str] | None = None,
+    optional: dict[str, str | None] | None = None,
+    environ: Mapping[str, str] = os.environ,
 ) -> dict[str, Any]:
     """Parse environment variables into a dictionary.
 
     Given a list of args and kwargs, use them as keys to parse the environment
     variables and return a dictionary with the values. args are required, kwargs
     are optional and use the value as default.
+
+    environ can be a config_sources.LayeredConfig to read files as well as the
+    environment.
     """
     required = required or []
     optional = optional or {}
 
-    if missing_vars := set(required).difference(os.environ):
+    if missing_vars := set(required).difference(environ):
         raise ValueError(
             f"Missing required environment variables: {', '.join(sorted(missing_vars))}"
         )
 
-    required_vars = {key: os.environ[key] for key in required}
+    required_vars = {key: environ[key] for key in required}
     optional_vars = {
-        key: os.environ.get(key, default) for key, default in optional.items()
+        key: environ.get(key, default) for key, default in optional.items()
     }
 
     return {**optional_vars, **required_vars}
@@ -42,4 +52,15 @@ assert parse_env_vars(required=["foo"], optional={"baz": "default"}) == {
     "baz": "default",
 }
 
+# Defaults from a JSON file, overridden by the environment
+with TemporaryDirectory() as tmp:
+    defaults = Path(tmp, "defaults.json")
+    defaults.write_text('{"foo": "default", "region": "eu"}')
+    layered = LayeredConfig(JsonSource(defaults), EnvSource())
+
+    assert parse_env_vars(required=["foo", "region"], environ=layered) == {
+        "foo": "bar",
+        "region": "eu",
+    }
+
 assert parse_env_vars(required=["boo", "zoo"])
@@ -1,6 +1,25 @@
+import functools
 import os
-from dataclasses import _MISSING_TYPE, dataclass, fields, is_dataclass
-from typing import Any, ClassVar, Dict, Protocol, Type
+import signal
+import types
+from collections.abc import Callable, Mapping
+from dataclasses import MISSING, Field, dataclass, field, fields, is_dataclass
+from enum import Enum
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Protocol,
+    Type,
+    Union,
+    get_args,
+    get_origin,
+    get_type_hints,
+)
+
+from config_sources import DotEnvSource, EnvSource, LayeredConfig, TomlSource
 
 
 class DataclassLike(Protocol):
@@ -9,7 +28,48 @@ class DataclassLike(Protocol):
     __dataclass_fields__: ClassVar[Dict[str, Any]]
 
 
-def parse_env_vars[T: DataclassLike](options: Type[T]) -> T:
+FALSE_VALUES = frozenset(("", "0", "false", "no", "off"))
+
+
+@functools.cache
+def _compile_cast(to_type: Any) -> Callable[[str], Any]:
+    """Return a function that converts an env var string into to_type"""
+    origin, args = get_origin(to_type), get_args(to_type)
+
+    if to_type is bool:
+        return lambda value: value.strip().lower() not in FALSE_VALUES
+    if origin in (Union, types.UnionType):
+        options = [a for a in args if a is not types.NoneType]
+        if len(options) < len(args):
+            # Optional, where an empty string means None
+            inner = _compile_cast(Union[tuple(options)])
+            return lambda value: None if value == "" else inner(value)
+        casts = [_compile_cast(a) for a in options]
+
+        def first_that_fits(value: str) -> Any:
+            for cast in casts:
+                try:
+                    return cast(value)
+                except (TypeError, ValueError, KeyError):
+                    pass
+            raise ValueError(f"'{value}' doesn't fit any of {to_type}")
+
+        return first_that_fits
+    if origin in (list, tuple, set, frozenset):
+        item = _compile_cast(args[0] if args else str)
+        return lambda value: origin(
+            item(v.strip()) for v in value.split(",") if value.strip()
+        )
+    if isinstance(to_type, type) and issubclass(to_type, Enum):
+        # Accept either the member's name or its value
+        members = {str(m.value): m for m in to_type} | to_type.__members__
+        return lambda value: members[value]
+    return to_type
+
+
+def parse_env_vars[T: DataclassLike](
+    options: Type[T], environ: Mapping[str, str] = os.environ
+) -> T:
     """Parse environment variables using a dataclass.
 
     Given a dataclass, use the field names as keys to parse the environment
@@ -17,34 +77,41 @@ def parse_env_vars[T: DataclassLike](options: Type[T]) -> T:
     without a default value are required, fields with a default value are optional
     and use the default if the environment variable is not set.
 
-    Bool fields are treated specially, if the envvar is set to any of "0", "false"
-    or "False" then the value is False, otherwise it is True if the envvar is set.
+    Values are cast the same way as for a ConfigLoader. Bool fields are treated
+    specially, if the envvar is empty or set to any of FALSE_VALUES, ignoring
+    case and surrounding spaces, then the value is False, otherwise it is True
+    if the envvar is set.
+
+    environ can be a config_sources.LayeredConfig to read files as well as the
+    environment.
     """
 
     def cast_type(value: str, to_type: Type) -> Any:
-        false_values = ("0", "false", "False")
+        return _compile_cast(to_type)(value)
 
-        if isinstance(to_type, bool):
-            return False if value in false_values else True
-        return to_type(value)
+    def has_default(f: Field) -> bool:
+        return f.default is not MISSING or f.default_factory is not MISSING
+
+    def default_value(f: Field) -> Any:
+        if f.default_factory is not MISSING:
+            return f.default_factory()
+        return f.default
 
     if not is_dataclass(options):
         raise ValueError("options argument must be a dataclass")
 
     # Extract the required and optional envvars from the options class
     required = [
-        {"key": f.name, "type": f.type}
-        for f in fields(options)
-        if isinstance(f.default, _MISSING_TYPE)
+        {"key": f.name, "type": f.type} for f in fields(options) if not has_default(f)
     ]
     optional = [
-        {"key": f.name, "type": f.type, "default": f.default}
+        {"key": f.name, "type": f.type, "field": f}
         for f in fields(options)
-        if not isinstance(f.default, _MISSING_TYPE)
+        if has_default(f)
     ]
 
     # Check all required vars exist in environ
-    if missing_vars := set([f["key"] for f in required]).difference(os.environ):
+    if missing_vars := set([f["key"] for f in required]).difference(environ):
         raise ValueError(
             f"Missing required environment variables: {', '.join(missing_vars)}"
         )
@@ -54,7 +121,7 @@ def parse_env_vars[T: DataclassLike](options: Type[T]) -> T:
     required_vars = {}
     for item in required:
         key, _type = item["key"], item["type"]
-        value = os.environ[key]
+        value = environ[key]
         try:
             value = cast_type(value, _type)
         except Exception:
@@ -63,11 +130,14 @@ def parse_env_vars[T: DataclassLike](options: Type[T]) -> T:
             )
         required_vars[key] = value
 
-    # Do the same for optional vars, but use the default if not set
+    # Do the same for optional vars, but use the default as it is if not set
     optional_vars = {}
     for item in optional:
-        key, _type, default = item["key"], item["type"], item["default"]
-        value = os.environ.get(key, default)
+        key, _type = item["key"], item["type"]
+        if key not in environ:
+            optional_vars[key] = default_value(item["field"])
+            continue
+        value = environ[key]
         try:
             value = cast_type(value, _type)
         except Exception:
@@ -90,18 +160,228 @@ os.environ["first_name"] = "foo"
 os.environ["age"] = "30"
 os.environ["enabled"] = "0"
 
-# assert parse_env_vars(Config) == Config(first_name="foo", age=30, enabled=False)
+assert parse_env_vars(Config) == Config(first_name="foo", age=30, enabled=False)
+
+os.environ["enabled"] = ""
+
+assert parse_env_vars(Config) == Config(first_name="foo", age=30, enabled=False)
+
+del os.environ["enabled"]
+
+assert parse_env_vars(Config) == Config(first_name="foo", age=30, enabled=False)
+
+for false_value in ("FALSE", "no", " off "):
+    os.environ["enabled"] = false_value
+    assert parse_env_vars(Config).enabled is False
+del os.environ["enabled"]
+
+
+"""
+parse_env_vars() works out which fields are required and how to cast them on
+every call. compile_parser() does that once per dataclass, and ConfigLoader
+only runs the compiled parser again when one of the env vars it reads has
+changed.
+"""
+
+
+def _constant(value: Any) -> Callable[[], Any]:
+    return lambda: value
+
+
+class CompiledParser[T: DataclassLike]:
+    """
+    A dataclass compiled into a list of (env var, cast, default) entries.
+
+    Nested dataclass fields read env vars prefixed with the field name, so a
+    db: Database field with a host field reads db_host. keys holds every env
+    var the parser reads, including those of nested dataclasses.
+    """
+
+    def __init__(self, options: Type[T], prefix: str = ""):
+        if not is_dataclass(options):
+            raise ValueError("options argument must be a dataclass")
+
+        self.options = options
+        self.fields = []
+        self.nested = []
+        hints = get_type_hints(options)
+        for f in fields(options):
+            if not f.init:
+                continue
+            to_type, key = hints[f.name], prefix + f.name
+            if f.default_factory is not MISSING:
+                default = f.default_factory
+            elif f.default is not MISSING:
+                default = _constant(f.default)
+            else:
+                default = None
+            if is_dataclass(to_type):
+                parser = compile_parser(to_type, f"{key}_")
+                self.nested.append((f.name, parser, default))
+            else:
+                self.fields.append(
+                    (f.name, key, to_type, _compile_cast(to_type), default)
+                )
+
+        self.keys = tuple(key for _, key, _, _, _ in self.fields) + tuple(
+            key for _, parser, _ in self.nested for key in parser.keys
+        )
+
+    def __call__(self, environ: Mapping[str, str]) -> T:
+        values = {}
+        missing = []
+        for name, key, to_type, cast, default in self.fields:
+            if key in environ:
+                value = environ[key]
+                try:
+                    values[name] = cast(value)
+                except Exception:
+                    raise TypeError(
+                        f"Unable to cast value '{value}' from key '{key}' to type "
+                        f"{to_type}"
+                    )
+            elif default is not None:
+                values[name] = default()
+            else:
+                missing.append(key)
+
+        if missing:
+            raise ValueError(
+                f"Missing required environment variables: {', '.join(missing)}"
+            )
+
+        for name, parser, default in self.nested:
+            if default is None or any(key in environ for key in parser.keys):
+                values[name] = parser(environ)
+            else:
+                values[name] = default()
+
+        return self.options(**values)
+
+
+@functools.cache
+def compile_parser[T: DataclassLike](
+    options: Type[T], prefix: str = ""
+) -> CompiledParser[T]:
+    return CompiledParser(options, prefix)
+
+
+class ConfigLoader[T: DataclassLike]:
+    """
+    Loads a dataclass from env vars with a parser compiled once, for code
+    that reads config often, like request handlers.
+
+    load() returns the same instance for as long as the env vars the parser
+    reads are unchanged, so it costs one lookup per env var. reload() parses
+    again straight away. If environ is a config_sources.LayeredConfig,
+    reload() refreshes it first, so edited config files are picked up.
+
+    After install_sighup() a SIGHUP makes the next load() reload. The handler
+    only sets a flag: it runs between two bytecodes of whatever the main
+    thread was doing, which may be a refresh() holding LayeredConfig's lock,
+    so reloading in the handler itself could deadlock.
+    """
+
+    def __init__(self, options: Type[T], environ: Mapping[str, str] = os.environ):
+        self.parser = compile_parser(options)
+        self.environ = environ
+        # (snapshot, config) swapped together so readers never see half of one
+        self._cached: tuple[tuple, T] | None = None
+        # Set by the SIGHUP handler, a plain bool because setting it takes no lock
+        self._reload_requested = False
+
+    def _snapshot(self) -> tuple:
+        return tuple(self.environ.get(key) for key in self.parser.keys)
+
+    def load(self) -> T:
+        if self._reload_requested:
+            self._reload_requested = False
+            return self.reload()
+        snapshot = self._snapshot()
+        cached = self._cached
+        if cached is not None and cached[0] == snapshot:
+            return cached[1]
+        config = self.parser(self.environ)
+        self._cached = (snapshot, config)
+        return config
+
+    def reload(self) -> T:
+        if isinstance(self.environ, LayeredConfig):
+            self.environ.refresh()
+        self._cached = None
+        return self.load()
+
+    def install_sighup(self):
+        """Reload on the next load() after a SIGHUP. Call from the main thread."""
+
+        def request_reload(signum, frame):
+            self._reload_requested = True
+
+        signal.signal(signal.SIGHUP, request_reload)
+
+
+class Level(Enum):
+    DEBUG = 10
+    INFO = 20
+
+
+@dataclass
+class Database:
+    host: str
+    port: int = 5432
+
+
+@dataclass
+class AppConfig:
+    name: str
+    db: Database
+    debug: bool = False
+    level: Level = Level.INFO
+    timeout: float | None = None
+    tags: list[str] = field(default_factory=list)
+
+
+os.environ["name"] = "app"
+os.environ["db_host"] = "localhost"
+os.environ["debug"] = "false"
+os.environ["level"] = "DEBUG"
+os.environ["timeout"] = ""
+os.environ["tags"] = "a, b"
+
+loader = ConfigLoader(AppConfig)
+config = loader.load()
+assert config == AppConfig(
+    name="app",
+    db=Database(host="localhost"),
+    level=Level.DEBUG,
+    tags=["a", "b"],
+)
+assert loader.load() is config
+
+# Changing a var the parser reads is picked up on the next load
+os.environ["db_port"] = "6543"
+assert loader.load().db.port == 6543
 
-# os.environ["enabled"] = ""
+loader.install_sighup()
+os.environ["level"] = "20"
+os.kill(os.getpid(), signal.SIGHUP)
+assert loader.load().level is Level.INFO
 
-# assert parse_env_vars(Config) == Config(first_name="foo", age=30, enabled=False)
-false_values = ("0", "false", "False")
-value = "0"
-to_type = bool
+# Defaults from a TOML file, then a mounted .env file, then the environment
+with TemporaryDirectory() as tmp:
+    defaults, dotenv = Path(tmp, "defaults.toml"), Path(tmp, ".env")
+    defaults.write_text('name = "toml"\ntags = ["x"]\n[db]\nhost = "db"\nport = 1\n')
+    dotenv.write_text("db_port=2\n")
+    layered = LayeredConfig(
+        TomlSource(defaults), DotEnvSource(dotenv), EnvSource({"debug": "yes"})
+    )
 
-print(value in false_values)
+    loader = ConfigLoader(AppConfig, layered)
+    assert loader.load() == AppConfig(
+        name="toml", db=Database(host="db", port=2), debug=True, tags=["x"]
+    )
 
-if isinstance(to_type, bool):
-    print(False if value in false_values else True)
-else:
-    print(to_type(value))
+    # A replaced file is picked up by the next reload, or load after a SIGHUP
+    Path(tmp, ".env.new").write_text("db_port=3\n")
+    os.replace(Path(tmp, ".env.new"), dotenv)
+    assert loader.reload().db.port == 3
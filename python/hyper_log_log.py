@@ -1,12 +1,29 @@
+import argparse
+import csv
 import hashlib
+import io
+import json
 import math
-from hashlib import sha1
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from functools import partial
+from hashlib import blake2b, sha1
+from itertools import batched
 from random import choice, randint
 from string import ascii_letters
-from sys import getsizeof
-from typing import TYPE_CHECKING, Callable
+from sys import getsizeof, stdin
+from time import perf_counter, time
+from typing import TYPE_CHECKING, Any, BinaryIO, Callable, Literal, Self
 
+import numpy as np
 from bitarray import bitarray, util
+from tabulate import tabulate
 
 # We can't import this typehint normally so we need to do this weird thing
 HASH = hashlib._hashlib.HASH  # ty: ignore[unresolved-attribute]
@@ -14,6 +31,256 @@ HASH = hashlib._hashlib.HASH  # ty: ignore[unresolved-attribute]
 if TYPE_CHECKING:
     from _typeshed import ReadableBuffer
 
+# blake2b can produce a digest of any size, and asking for a 64 bit one makes
+# it noticeably cheaper than sha1 while still being in the standard library
+blake2b64 = partial(blake2b, digest_size=8)
+
+FNV_OFFSET = 0xCBF29CE484222325
+FNV_PRIME = 0x100000001B3
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+class Fnv1a64:
+    """
+    A 64 bit FNV-1a hash followed by the MurmurHash3 finalizer.
+
+    FNV-1a on its own mixes the top bits poorly for short keys, which matters
+    because the top bits pick the bucket, so the finalizer is used to spread
+    them out. It has the same interface as the hashlib constructors, so it can
+    be passed as the hashing_algo of a HyperLogLog, and it can also hash a
+    whole batch of keys at once with NumPy using hash_many().
+
+    Hashing one key at a time is pure Python and slow, this is meant to be
+    used with ingest_many() and ingest_array().
+    """
+
+    name = "fnv1a64"
+    digest_size = 8
+
+    def __init__(self, data: bytes = b""):
+        self.value = FNV_OFFSET
+        self.update(data)
+
+    def update(self, data: bytes) -> None:
+        value = self.value
+        for byte in data:
+            value = ((value ^ byte) * FNV_PRIME) & MASK_64
+        self.value = value
+
+    def digest(self) -> bytes:
+        value = self.value
+        value ^= value >> 33
+        value = (value * 0xFF51AFD7ED558CCD) & MASK_64
+        value ^= value >> 33
+        value = (value * 0xC4CEB9FE1A85EC53) & MASK_64
+        value ^= value >> 33
+        return value.to_bytes(8, "big")
+
+    @staticmethod
+    def hash_many(keys: list[bytes]) -> np.ndarray:
+        """Hash a batch of keys, returning the digests as an array of uint64.
+
+        The keys are laid out as rows of a zero padded byte matrix and hashed a
+        column at a time, so the work is one NumPy operation per byte of the
+        longest key rather than one Python operation per byte of every key.
+        """
+        lengths = np.fromiter(map(len, keys), dtype=np.int64, count=len(keys))
+        width = int(lengths.max(initial=0))
+        matrix = np.frombuffer(
+            b"".join(k.ljust(width, b"\x00") for k in keys), dtype=np.uint8
+        ).reshape(len(keys), width)
+
+        values = np.full(len(keys), FNV_OFFSET, dtype=np.uint64)
+        for column in range(width):
+            mixed = (values ^ matrix[:, column]) * np.uint64(FNV_PRIME)
+            np.copyto(values, mixed, where=lengths > column)
+
+        values ^= values >> 33
+        values *= np.uint64(0xFF51AFD7ED558CCD)
+        values ^= values >> 33
+        values *= np.uint64(0xC4CEB9FE1A85EC53)
+        values ^= values >> 33
+        return values
+
+
+# Hashing algorithms that can be chosen by name from the command line or looked
+# up by name when loading a sketch, on top of the ones in hashlib
+HASH_ALGOS: dict[str, Callable[..., Any]] = {
+    "sha1": sha1,
+    "blake2b64": blake2b64,
+    "fnv1a64": Fnv1a64,
+}
+
+
+class PackedRegisters:
+    """
+    Registers packed into 6 bits each, so every 4 registers fit in 3 bytes.
+
+    6 bits is enough to hold any cardinality from a 64 bit hash. It supports the
+    same operations the HyperLogLog uses on a list of registers (indexing,
+    iterating, len() and count()) so it can be used in place of one.
+    """
+
+    max_value = 63
+
+    def __init__(self, length: int):
+        self.length = length
+        # One spare byte at the end so reading the last register can always
+        # look at two bytes
+        self.data = bytearray(math.ceil(length / 4) * 3 + 1)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, idx: int) -> int:
+        byte, offset = divmod(idx * 6, 8)
+        return ((self.data[byte] | self.data[byte + 1] << 8) >> offset) & 0x3F
+
+    def __setitem__(self, idx: int, value: int) -> None:
+        byte, offset = divmod(idx * 6, 8)
+        word = self.data[byte] | self.data[byte + 1] << 8
+        word = (word & ~(0x3F << offset)) | (value << offset)
+        self.data[byte] = word & 0xFF
+        self.data[byte + 1] = word >> 8
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_numpy().tolist())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PackedRegisters):
+            return self.length == other.length and self.data == other.data
+        return NotImplemented
+
+    def count(self, value: int) -> int:
+        return int(np.count_nonzero(self.to_numpy() == value))
+
+    def to_numpy(self) -> np.ndarray:
+        """Unpack the registers into a uint8 array"""
+        bit = np.arange(self.length, dtype=np.int64) * 6
+        byte, offset = bit >> 3, (bit & 7).astype(np.uint16)
+        data = np.frombuffer(self.data, dtype=np.uint8).astype(np.uint16)
+        return (((data[byte] | data[byte + 1] << 8) >> offset) & 0x3F).astype(np.uint8)
+
+    def from_numpy(self, values: np.ndarray) -> None:
+        """Pack a uint8 array of registers, 4 at a time into 3 bytes"""
+        padded = np.zeros(math.ceil(self.length / 4) * 4, dtype=np.uint32)
+        padded[: self.length] = values
+        groups = padded.reshape(-1, 4)
+        words = (
+            groups[:, 0] | groups[:, 1] << 6 | groups[:, 2] << 12 | groups[:, 3] << 18
+        )
+        packed = words.astype("<u4").view(np.uint8).reshape(-1, 4)[:, :3]
+        self.data[:-1] = packed.tobytes()
+
+
+class SparseRegisters:
+    """
+    Registers stored as a sorted array of only the ones that are not zero.
+
+    Each entry is the bucket and its value packed into one 32 bit int, as
+    bucket << 8 | value, so a sketch that has only seen a few hundred keys
+    needs a few hundred 4 byte entries rather than one entry per register.
+    Reads are a binary search and writes insert into the sorted array, which
+    is cheap while it is small. It supports the same operations as the other
+    register storages.
+    """
+
+    max_value = 0xFF
+
+    def __init__(self, length: int):
+        self.length = length
+        self.entries = array("I")
+
+    def __len__(self) -> int:
+        return self.length
+
+    def _find(self, idx: int) -> int:
+        return bisect_left(self.entries, idx << 8)
+
+    def __getitem__(self, idx: int) -> int:
+        pos = self._find(idx)
+        if pos < len(self.entries) and self.entries[pos] >> 8 == idx:
+            return self.entries[pos] & 0xFF
+        return 0
+
+    def __setitem__(self, idx: int, value: int) -> None:
+        pos = self._find(idx)
+        if pos < len(self.entries) and self.entries[pos] >> 8 == idx:
+            if value:
+                self.entries[pos] = idx << 8 | value
+            else:
+                del self.entries[pos]
+        elif value:
+            self.entries.insert(pos, idx << 8 | value)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_numpy().tolist())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, SparseRegisters):
+            return self.length == other.length and self.entries == other.entries
+        return NotImplemented
+
+    def count(self, value: int) -> int:
+        if value == 0:
+            return self.length - len(self.entries)
+        return sum(1 for entry in self.entries if entry & 0xFF == value)
+
+    def to_numpy(self) -> np.ndarray:
+        """Expand the registers into a dense uint8 array"""
+        registers = np.zeros(self.length, dtype=np.uint8)
+        entries = np.frombuffer(self.entries, dtype=np.uint32)
+        registers[entries >> 8] = entries & 0xFF
+        return registers
+
+    def from_numpy(self, values: np.ndarray) -> None:
+        """Replace the registers with the non-zero values of a dense array"""
+        buckets = np.flatnonzero(values).astype(np.uint32)
+        entries = buckets << 8 | values[buckets].astype(np.uint32)
+        self.entries = array("I", entries.tobytes())
+
+
+type Registers = list[int] | array[int] | PackedRegisters | SparseRegisters
+type Storage = Literal["list", "array", "packed"]
+STORAGES: tuple[Storage, ...] = ("list", "array", "packed")
+
+# Serialized sketches start with a magic number, a format version, then the
+# register bits, storage, register encoding, hash digest size and hash name length
+HEADER = struct.Struct("<4sBBBBBB")
+MAGIC = b"HLL\x00"
+VERSION = 1
+
+# How the registers are encoded in a serialized sketch
+ENCODING_PACKED = 0  # 6 bits per register
+ENCODING_BYTES = 1  # 1 byte per register
+ENCODING_SHORTS = 2  # 2 bytes per register
+ENCODING_SPARSE = 3  # 4 bytes per non-zero register, as SparseRegisters entries
+
+
+def deep_getsizeof(obj: Any, seen: set[int] | None = None) -> int:
+    """
+    Returns the size of an object in bytes including everything it references.
+
+    getsizeof() only measures the object itself, so a list of ints is just the
+    size of the pointers and not the ints they point to. Objects referenced
+    more than once are only counted once.
+    """
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(
+            deep_getsizeof(k, seen) + deep_getsizeof(v, seen) for k, v in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_getsizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_getsizeof(vars(obj), seen)
+    return size
+
 
 class HyperLogLog:
     """A pure Python implementation of HyperLogLog"""
@@ -22,25 +289,81 @@ class HyperLogLog:
         self,
         hashing_algo: Callable[["ReadableBuffer"], HASH] = sha1,
         register_bits: int = 14,
+        storage: Storage = "list",
+        sparse: bool = False,
+        sparse_threshold: int | None = None,
     ):
         """Initialize the HyperLogLog data structure.
 
         args:
             hashing_algo: The hashing algorithm to use to calculate cardinality.
             register_bits: The number of bits to use for the registers. This determines the number of registers as 2^register_bits.
+            storage: How to store the registers. "list" is a plain list of ints,
+                "array" uses one byte per register and "packed" uses 6 bits per
+                register.
+            sparse: Start by only storing the registers that are not zero, and
+                switch to storage once more than sparse_threshold are set.
+            sparse_threshold: How many registers can be set before a sparse
+                sketch switches to storage. Defaults to a quarter of the
+                registers, where the sparse entries take as much memory as
+                "array" storage would.
         """
         self.algo = hashing_algo
         self.register_bits = register_bits
+        self.storage = storage
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown register storage '{storage}'")
 
         # Calculate the number of registers we will need
         self.register_length = 2**register_bits
 
         # Initialize the registers to zero
-        self.registers: list[int] = [0 for _ in range(self.register_length)]
+        self.sparse = sparse
+        self.sparse_threshold = sparse_threshold or self.register_length // 4
+        self.registers: Registers = (
+            SparseRegisters(self.register_length) if sparse else self._new_registers()
+        )
 
         # We need to know the bit length of the algo later so calculate this now
         self.hash_bit_length = self.algo().digest_size * 8
 
+        # The largest cardinality the hash can produce is the length of the
+        # suffix + 1. The compact storages can't hold values that big for long
+        # hashes like sha1, so cap it at what they can hold instead. Reaching
+        # the cap needs a run of 63 zeros, so in practice it never matters.
+        self.max_cardinality = self.hash_bit_length - register_bits + 1
+        if storage == "array":
+            self.max_cardinality = min(self.max_cardinality, 255)
+        elif storage == "packed":
+            self.max_cardinality = min(self.max_cardinality, PackedRegisters.max_value)
+        if sparse:
+            self.max_cardinality = min(self.max_cardinality, SparseRegisters.max_value)
+
+        # Keep a count of how many registers hold each value, so estimate()
+        # doesn't need to look at every register. Every register starts at zero.
+        self.histogram = [0] * (self.max_cardinality + 1)
+        self.histogram[0] = self.register_length
+
+    def _new_registers(self) -> Registers:
+        """Returns a new set of registers set to zero in the chosen storage"""
+        if self.storage == "array":
+            return array("B", bytes(self.register_length))
+        if self.storage == "packed":
+            return PackedRegisters(self.register_length)
+        return [0 for _ in range(self.register_length)]
+
+    def _promote_if_full(self) -> None:
+        """Switch a sparse sketch to its storage once it has too many entries"""
+        if (
+            self.sparse
+            and isinstance(self.registers, SparseRegisters)
+            and len(self.registers.entries) > self.sparse_threshold
+        ):
+            registers = self.registers.to_numpy()
+            self.registers = self._new_registers()
+            self._registers_from_numpy(registers)
+            self.sparse = False
+
     def get_bucket_and_cardinality(self, data: str) -> tuple[int, int]:
         """
         Returns a tuple consisting of the bucket and the cardinality of
@@ -51,6 +374,9 @@ class HyperLogLog:
         """
         # 1. Hash the data
         digest = self.algo(data.encode()).digest()
+        return self._bucket_and_cardinality_from_digest(digest)
+
+    def _bucket_and_cardinality_from_digest(self, digest: bytes) -> tuple[int, int]:
         # 2. Convert the digest to a bitarray
         bits = bitarray(digest)
         # 3. Split the bitarray into the bucket and the suffix
@@ -71,11 +397,181 @@ class HyperLogLog:
     def ingest(self, data: str) -> None:
         """Process data and add the result to the buckets."""
         bucket, cardinality = self.get_bucket_and_cardinality(data)
+        cardinality = min(cardinality, self.max_cardinality)
 
-        if self.registers[bucket] < cardinality:
+        previous = self.registers[bucket]
+        if previous < cardinality:
             self.registers[bucket] = cardinality
+            self.histogram[previous] -= 1
+            self.histogram[cardinality] += 1
+            self._promote_if_full()
+
+    def ingest_many(self, data: Iterable[str], batch_size: int = 65_536) -> None:
+        """Process many items at once.
+
+        The items are consumed in batches of batch_size, so the iterable can be
+        arbitrarily long. The resulting registers are identical to calling
+        ingest() on each item in turn.
+        """
+        for batch in batched(data, batch_size):
+            self._ingest_encoded([d.encode() for d in batch])
+
+    def ingest_array(self, data: np.ndarray, batch_size: int = 65_536) -> None:
+        """Process a NumPy array of items at once.
+
+        Byte string arrays (dtype "S") are hashed as-is, anything else is
+        converted with str() first, matching what ingest(str(item)) would do.
+        """
+        for start in range(0, len(data), batch_size):
+            batch = data[start : start + batch_size].tolist()
+            if data.dtype.kind == "S":
+                self._ingest_encoded(batch)
+            else:
+                self._ingest_encoded([str(d).encode() for d in batch])
+
+    def _ingest_encoded(self, keys: list[bytes]) -> None:
+        """Hash a batch of keys and fold them into the registers in one go.
+
+        Hashing still happens per key, but the digests are joined into a single
+        buffer so the bucket and cardinality of every key can be worked out with
+        vectorized NumPy operations on the first 64 bits of each digest.
+        """
+        if not keys:
+            return
+
+        # 1. Hash every key and take the first 64 bits of each digest
+        words = self._hash_words(keys)
+
+        # 2. The bucket is the top register_bits bits
+        buckets = words >> (64 - self.register_bits)
+
+        # 3. The cardinality is the position of the first 1 in the suffix. To
+        # count the leading zeros, smear the highest set bit to the right and
+        # count how many bits are set.
+        suffix = words << self.register_bits
+        smeared = suffix.copy()
+        for shift in (1, 2, 4, 8, 16, 32):
+            smeared |= smeared >> shift
+        cardinalities = 65 - np.bitwise_count(smeared).astype(np.int64)
+
+        # 4. If the suffix within the first 64 bits is all zeros then either the
+        # digest has no 1 in it at all, or for hashes longer than 64 bits the
+        # first 1 is further along. The second case is rare enough to fall back
+        # to the bit by bit method for those keys.
+        all_zeros = suffix == 0
+        if self.hash_bit_length <= 64:
+            cardinalities[all_zeros] = self.hash_bit_length - self.register_bits + 1
+        else:
+            for idx in np.flatnonzero(all_zeros):
+                _, cardinalities[idx] = self._bucket_and_cardinality_from_digest(
+                    self.algo(keys[idx]).digest()
+                )
+
+        # 5. Reduce everything into the registers with a single scatter max
+        np.minimum(cardinalities, self.max_cardinality, out=cardinalities)
+        registers = self._registers_to_numpy()
+        np.maximum.at(
+            registers, buckets.astype(np.intp), cardinalities.astype(registers.dtype)
+        )
+        self._registers_from_numpy(registers)
+
+    def _hash_words(self, keys: list[bytes]) -> np.ndarray:
+        """Returns the first 64 bits of the digest of each key as uint64s.
+
+        If the hashing algorithm can hash a whole batch at once it is used,
+        otherwise the keys are hashed one at a time into a single buffer.
+        Digests shorter than 64 bits are padded with zeros on the right.
+        """
+        if hasattr(self.algo, "hash_many"):
+            return self.algo.hash_many(keys)
+
+        digest_size = self.hash_bit_length // 8
+        digests = b"".join([self.algo(k).digest() for k in keys])
+        rows = np.frombuffer(digests, dtype=np.uint8).reshape(len(keys), digest_size)
+
+        head = np.zeros((len(keys), 8), dtype=np.uint8)
+        head[:, : min(digest_size, 8)] = rows[:, :8]
+        return head.view(">u8").ravel().astype(np.uint64)
+
+    def _registers_to_numpy(self) -> np.ndarray:
+        """Returns the registers as a NumPy array.
+
+        For "array" storage this is a view of the same memory, so changes to it
+        are seen by the registers straight away.
+        """
+        if isinstance(self.registers, array):
+            return np.frombuffer(self.registers, dtype=np.uint8)
+        if isinstance(self.registers, (PackedRegisters, SparseRegisters)):
+            return self.registers.to_numpy()
+        return np.array(self.registers, dtype=np.int64)
+
+    def _registers_from_numpy(self, registers: np.ndarray) -> None:
+        """Write a NumPy array back into the registers"""
+        self.histogram = self._count_registers(registers)
+        if isinstance(self.registers, array):
+            if not np.shares_memory(registers, np.frombuffer(self.registers, np.uint8)):
+                self.registers[:] = array("B", registers.astype(np.uint8).tobytes())
+        elif isinstance(self.registers, (PackedRegisters, SparseRegisters)):
+            self.registers.from_numpy(registers)
+            self._promote_if_full()
+        else:
+            self.registers[:] = registers.tolist()
+
+    def _count_registers(self, registers: np.ndarray) -> list[int]:
+        """Returns how many registers hold each value"""
+        return np.bincount(registers, minlength=self.max_cardinality + 1).tolist()
+
+    def is_consistent(self) -> bool:
+        """
+        Check the running histogram of register values against the registers.
+
+        The histogram is updated every time a register changes so estimates
+        don't have to look at every register. This recounts it from scratch
+        and checks it, and the estimate made from it, match exactly.
+        """
+        histogram = self._count_registers(self._registers_to_numpy())
+        return histogram == self.histogram and self._estimate(
+            histogram
+        ) == self._estimate(self.histogram)
 
     def estimate(self) -> int:
+        """
+        Estimate the cardinality using Ertl's improved estimator.
+
+        This only needs the histogram of register values, which is kept up to
+        date as keys are ingested, so it takes the same time however many
+        registers there are.
+
+        The classic estimator is biased for cardinalities up to a few times the
+        number of registers, which is why it switches to linear counting and
+        why HyperLogLog++ subtracts an empirically measured bias. This
+        estimator instead uses the histogram of register values to correct for
+        the zero registers and the saturated ones directly, so it is unbiased
+        over the whole range without any tables of bias values.
+
+        See "New cardinality estimation algorithms for HyperLogLog sketches",
+        Otmar Ertl, 2017.
+        """
+        return self._estimate(self.histogram)
+
+    def _estimate(self, histogram: list[int]) -> int:
+        m = self.register_length
+        # Registers go from 0 to q + 1, where q + 1 means the suffix was all zeros
+        q = self.max_cardinality - 1
+
+        # 1. Correct for the saturated registers
+        z = m * _tau(1 - histogram[q + 1] / m)
+        # 2. Add the registers in between, halving each step
+        for k in range(q, 0, -1):
+            z = 0.5 * (z + histogram[k])
+        # 3. Correct for the registers that are still zero
+        z += m * _sigma(histogram[0] / m)
+
+        alpha_inf = 1 / (2 * math.log(2))
+        return int(alpha_inf * m**2 / z)
+
+    def estimate_classic(self) -> int:
+        """Estimate the cardinality using the original HyperLogLog algorithm"""
         # Calculate the alpha constant based on number of registers
         m = self.register_length
         if m == 16:
@@ -88,12 +584,14 @@ class HyperLogLog:
             alpha_m = 0.7213 / (1 + 1.079 / m)
 
         # 1. Raw estimation using the harmonic mean
-        sum_inverse_powers = sum(2 ** (-reg) for reg in self.registers)
+        sum_inverse_powers = sum(
+            count * 2 ** (-reg) for reg, count in enumerate(self.histogram)
+        )
         raw_estimate = alpha_m * (m**2) / sum_inverse_powers
 
         # 2. Small range correction
         if raw_estimate < 2.5 * m:
-            zero_registers = self.registers.count(0)
+            zero_registers = self.histogram[0]
             if zero_registers != 0:
                 corrected_estimate = m * math.log(m / zero_registers)
             else:
@@ -102,10 +600,13 @@ class HyperLogLog:
                 )
             return int(corrected_estimate)
 
-        # 3. Large range correction
+        # 3. Large range correction, for when hash collisions start to matter.
+        # This depends on the size of the hash space, so for a 64 bit hash it
+        # only kicks in past 2^64 / 30. log1p keeps it accurate when the
+        # estimate is tiny compared to the hash space.
         elif raw_estimate > (2**self.hash_bit_length) / 30:
-            corrected_estimate = -(2**self.hash_bit_length) * math.log(
-                1 - raw_estimate / (2**self.hash_bit_length)
+            corrected_estimate = -(2**self.hash_bit_length) * math.log1p(
+                -raw_estimate / (2**self.hash_bit_length)
             )
             return int(corrected_estimate)
 
@@ -113,10 +614,382 @@ class HyperLogLog:
         else:
             return int(raw_estimate)
 
+    @property
+    def hash_name(self) -> str:
+        """The name of the hashing algorithm, as recorded when serialized"""
+        return self.algo().name
+
+    def is_compatible(self, other: "HyperLogLog") -> bool:
+        """Sketches can only be merged if they bucket and hash keys the same way"""
+        return (
+            self.register_bits == other.register_bits
+            and self.hash_name == other.hash_name
+            and self.hash_bit_length == other.hash_bit_length
+        )
+
+    def _check_compatible(self, other: "HyperLogLog") -> None:
+        if not self.is_compatible(other):
+            raise ValueError(
+                f"Cannot merge a sketch using {other.hash_name} ({other.hash_bit_length} bits) "
+                f"with {other.register_bits} register bits into one using {self.hash_name} "
+                f"({self.hash_bit_length} bits) with {self.register_bits} register bits"
+            )
+
+    def empty_copy(self) -> Self:
+        """Returns a new, empty sketch with the same settings as this one"""
+        return type(self)(
+            self.algo,
+            self.register_bits,
+            self.storage,
+            self.sparse,
+            self.sparse_threshold,
+        )
+
+    def update(self, *others: "HyperLogLog") -> None:
+        """
+        Merge other sketches into this one in place.
+
+        The merged registers are the register-wise max of all the sketches.
+        All the sketches are stacked and reduced together, so merging N sketches
+        is a single pass over the registers rather than N-1 pairwise merges.
+        """
+        for other in others:
+            self._check_compatible(other)
+        if not others:
+            return
+
+        registers = self._registers_to_numpy()
+        stacked = np.stack(
+            [registers, *(other._registers_to_numpy() for other in others)]
+        )
+        merged = np.minimum(stacked.max(axis=0), self.max_cardinality)
+        registers[:] = merged
+        self._registers_from_numpy(registers)
+
+    def merge(self, *others: "HyperLogLog") -> Self:
+        """Returns a new sketch counting everything in this and the other sketches"""
+        merged = self.empty_copy()
+        merged.update(self, *others)
+        return merged
+
+    @staticmethod
+    def merge_all(sketches: Iterable["HyperLogLog"]) -> "HyperLogLog":
+        """Merge any number of compatible sketches into a new one in one pass"""
+        sketches = list(sketches)
+        if not sketches:
+            raise ValueError("merge_all needs at least one sketch")
+        first, *rest = sketches
+        return first.merge(*rest)
+
+    def __or__(self, other: "HyperLogLog") -> Self:
+        return self.merge(other)
+
+    def __ior__(self, other: "HyperLogLog") -> Self:
+        self.update(other)
+        return self
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the sketch into a compact binary format.
+
+        The header records everything needed to check two sketches are
+        compatible. Registers are packed into 6 bits each if they are small
+        enough, which they always are for hashes up to 64 bits.
+        """
+        registers = self._registers_to_numpy()
+        largest = int(registers.max())
+        if isinstance(self.registers, SparseRegisters):
+            encoding, body = ENCODING_SPARSE, self.registers.entries.tobytes()
+        elif largest <= PackedRegisters.max_value:
+            encoding = ENCODING_PACKED
+            packed = PackedRegisters(self.register_length)
+            packed.from_numpy(registers)
+            body = bytes(packed.data[:-1])
+        elif largest <= 0xFF:
+            encoding, body = ENCODING_BYTES, registers.astype(np.uint8).tobytes()
+        else:
+            encoding, body = ENCODING_SHORTS, registers.astype("<u2").tobytes()
+
+        name = self.hash_name.encode()
+        header = HEADER.pack(
+            MAGIC,
+            VERSION,
+            self.register_bits,
+            STORAGES.index(self.storage),
+            encoding,
+            self.hash_bit_length // 8,
+            len(name),
+        )
+        return header + name + body
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Self:
+        """Load a sketch serialized with to_bytes()"""
+        magic, version, register_bits, storage, encoding, digest_size, name_length = (
+            HEADER.unpack_from(data)
+        )
+        if magic != MAGIC:
+            raise ValueError("Data is not a serialized HyperLogLog")
+        if version != VERSION:
+            raise ValueError(f"Unsupported HyperLogLog format version {version}")
+
+        offset = HEADER.size + name_length
+        name = data[HEADER.size : offset].decode()
+        algo = HASH_ALGOS.get(name) or getattr(hashlib, name)
+        if algo().digest_size != digest_size:
+            # Variable length hashes like blake2b need the size passing in
+            algo = partial(algo, digest_size=digest_size)
+
+        hll = cls(algo, register_bits, STORAGES[storage], encoding == ENCODING_SPARSE)
+        if encoding == ENCODING_SPARSE:
+            registers = SparseRegisters(hll.register_length)
+            registers.entries.frombytes(data[offset:])
+            registers = registers.to_numpy()
+        elif encoding == ENCODING_PACKED:
+            packed = PackedRegisters(hll.register_length)
+            packed.data[:-1] = data[offset:]
+            registers = packed.to_numpy()
+        elif encoding == ENCODING_BYTES:
+            registers = np.frombuffer(data, dtype=np.uint8, offset=offset)
+        else:
+            registers = np.frombuffer(data, dtype="<u2", offset=offset)
+
+        if len(registers) != hll.register_length:
+            raise ValueError("Serialized HyperLogLog has the wrong number of registers")
+        hll._registers_from_numpy(registers)
+        return hll
+
+
+def _sigma(x: float) -> float:
+    """Ertl's sigma function, used to correct for registers that are zero"""
+    if x == 1:
+        return math.inf
+    y, z = 1.0, x
+    while True:
+        x *= x
+        previous, z = z, z + x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x: float) -> float:
+    """Ertl's tau function, used to correct for registers that are saturated"""
+    if x == 0 or x == 1:
+        return 0.0
+    y, z = 1.0, 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+def _ingest_chunk(template: bytes, keys: tuple[str, ...]) -> bytes:
+    """Worker for parallel_ingest(), returns a serialized partial sketch"""
+    hll = HyperLogLog.from_bytes(template)
+    hll.ingest_many(keys)
+    return hll.to_bytes()
+
+
+def _ingest_file_range(
+    template: bytes, path: str, start: int, end: int, block_size: int
+) -> bytes:
+    """
+    Worker for parallel_ingest_file(), returns a serialized partial sketch.
+
+    A line belongs to the range it starts in, so unless the range starts the
+    file the worker skips ahead to the first line that starts in it, and it
+    finishes the line that straddles the end of the range.
+    """
+    hll = HyperLogLog.from_bytes(template)
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            block = f.read(min(block_size, end - f.tell()))
+            if not block.endswith(b"\n"):
+                block += f.readline()
+            # Split the same way as read_lines(), so only on \n
+            lines = block.split(b"\n")
+            if not lines[-1]:
+                lines.pop()
+            hll._ingest_encoded([line.rstrip(b"\r") for line in lines])
+    return hll.to_bytes()
+
+
+def _reduce(hll: HyperLogLog, futures: Iterable[Future[bytes]]) -> None:
+    hll.update(*(HyperLogLog.from_bytes(future.result()) for future in futures))
+
+
+def parallel_ingest(
+    data: Iterable[str],
+    hll: HyperLogLog | None = None,
+    workers: int | None = None,
+    chunk_size: int = 100_000,
+) -> HyperLogLog:
+    """
+    Ingest data across a pool of processes and merge the results into hll.
+
+    The data is sent to the workers in chunks, at most two per worker at a
+    time so the iterable is never all in memory. Each worker builds a partial
+    sketch and sends it back serialized with to_bytes(), which is far smaller
+    than a pickled list of registers, and the partial sketches are merged
+    into hll as they come back.
+
+    The workers recreate the sketch from its serialized form, so the hashing
+    algorithm has to be one from_bytes() can find by name.
+    """
+    hll = hll or HyperLogLog()
+    workers = workers or os.process_cpu_count() or 1
+    template = hll.empty_copy().to_bytes()
+
+    with ProcessPoolExecutor(workers) as exe:
+        pending: set[Future[bytes]] = set()
+        for chunk in batched(data, chunk_size):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                _reduce(hll, done)
+            pending.add(exe.submit(_ingest_chunk, template, chunk))
+        _reduce(hll, pending)
+
+    return hll
+
+
+def parallel_ingest_file(
+    path: str,
+    hll: HyperLogLog | None = None,
+    workers: int | None = None,
+    block_size: int = 1 << 20,
+) -> HyperLogLog:
+    """
+    Ingest every line of a file across a pool of processes.
+
+    The file is split into one byte range per worker and each worker reads
+    its own range, so none of the data has to be sent between processes.
+    """
+    hll = hll or HyperLogLog()
+    workers = workers or os.process_cpu_count() or 1
+    template = hll.empty_copy().to_bytes()
+
+    size = os.path.getsize(path)
+    bounds = [size * i // workers for i in range(workers + 1)]
+    with ProcessPoolExecutor(workers) as exe:
+        futures = [
+            exe.submit(_ingest_file_range, template, path, start, end, block_size)
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        _reduce(hll, futures)
+
+    return hll
+
+
+class WindowedHyperLogLog:
+    """
+    Counts the distinct values seen in a sliding window of time.
+
+    Time is split into intervals, each with its own sketch, and a ring of the
+    sketches for the intervals in the window is kept. Expiring an interval is
+    just dropping its sketch, so memory is bounded by the number of intervals
+    in the window. Estimates merge the sketches in the window.
+
+    The intervals before the current one can't change (unless a late value
+    arrives for one of them), so their merged sketch is cached and a query
+    only has to merge it with the current interval.
+    """
+
+    def __init__(self, window: float, interval: float, **kwargs: Any):
+        """Initialize the windowed HyperLogLog.
+
+        args:
+            window: How many seconds of values to count.
+            interval: How many seconds each sketch covers. The window is
+                rounded up to a whole number of intervals.
+            kwargs: Passed to HyperLogLog to create each sketch. Sketches are
+                sparse by default, as each one only sees part of the values.
+        """
+        self.interval = interval
+        self.interval_count = math.ceil(window / interval)
+        self.template = HyperLogLog(**{"sparse": True, **kwargs})
+
+        # Pairs of the interval number and its sketch, oldest first
+        self.sketches: deque[tuple[int, HyperLogLog]] = deque()
+        # The merged sketch of every interval but the newest, and the first and
+        # last interval it covers
+        self._closed: tuple[int, int, HyperLogLog] | None = None
+
+    def _expire(self, current: int) -> None:
+        """Drop the sketches for intervals that have left the window"""
+        while self.sketches and self.sketches[0][0] <= current - self.interval_count:
+            self.sketches.popleft()
+
+    def _sketch_for(self, timestamp: float) -> HyperLogLog | None:
+        """Returns the sketch for the interval a timestamp falls in"""
+        slot = int(timestamp // self.interval)
+        newest = self.sketches[-1][0] if self.sketches else slot
+        if slot <= newest - self.interval_count:
+            # Too late to count
+            return None
+        if slot > newest or not self.sketches:
+            self._expire(slot)
+            self.sketches.append((slot, self.template.empty_copy()))
+            return self.sketches[-1][1]
+        if slot == newest:
+            return self.sketches[-1][1]
+
+        # A late value for an earlier interval, which also makes the cached
+        # merge of the earlier intervals out of date
+        self._closed = None
+        for idx in range(len(self.sketches) - 1, -1, -1):
+            if self.sketches[idx][0] == slot:
+                return self.sketches[idx][1]
+            if self.sketches[idx][0] < slot:
+                self.sketches.insert(idx + 1, (slot, self.template.empty_copy()))
+                return self.sketches[idx + 1][1]
+        self.sketches.appendleft((slot, self.template.empty_copy()))
+        return self.sketches[0][1]
+
+    def ingest(self, data: str, timestamp: float | None = None) -> None:
+        """Count a value as seen at timestamp, which defaults to now"""
+        if sketch := self._sketch_for(time() if timestamp is None else timestamp):
+            sketch.ingest(data)
+
+    def ingest_many(self, data: Iterable[str], timestamp: float | None = None) -> None:
+        """Count many values as all seen at timestamp, which defaults to now"""
+        if sketch := self._sketch_for(time() if timestamp is None else timestamp):
+            sketch.ingest_many(data)
+
+    def merged(self, timestamp: float | None = None) -> HyperLogLog:
+        """Returns one sketch of everything in the window ending at timestamp"""
+        current = int((time() if timestamp is None else timestamp) // self.interval)
+        self._expire(current)
+        if not self.sketches:
+            return self.template.empty_copy()
+
+        *closed, (_, newest) = self.sketches
+        if not closed:
+            return newest.merge()
+
+        first_slot, last_slot = closed[0][0], closed[-1][0]
+        if self._closed is None or self._closed[:2] != (first_slot, last_slot):
+            self._closed = (
+                first_slot,
+                last_slot,
+                HyperLogLog.merge_all(s for _, s in closed),
+            )
+        return self._closed[2].merge(newest)
+
+    def estimate(self, timestamp: float | None = None) -> int:
+        """Estimate the distinct values seen in the window ending at timestamp"""
+        return self.merged(timestamp).estimate()
+
 
 def test() -> None:
     for rb in [4, 8, 10, 14]:
-        estimates = []
+        estimates, classic_estimates = [], []
         for _ in range(10):
             data = [
                 "".join([choice(ascii_letters) for _ in range(10)]) for _ in range(1000)
@@ -126,6 +999,7 @@ def test() -> None:
             for d in data:
                 hll.ingest(d)
             estimates.append(hll.estimate())
+            classic_estimates.append(hll.estimate_classic())
 
         print(f"Registers: {hll.register_length}")
         print(f"Estimates: {max(estimates)=}, {min(estimates)=}")
@@ -137,6 +1011,10 @@ def test() -> None:
         print(
             f"Average Error: {abs(((float(avg) - len(set(data))) / len(set(data))) * 100):.2f}%"
         )
+        classic_avg = int(sum(classic_estimates) / len(classic_estimates))
+        print(
+            f"Average Error (classic): {abs(((float(classic_avg) - len(set(data))) / len(set(data))) * 100):.2f}%"
+        )
         print(f"Real Total: {len(data)}")
         print(f"Real Unique: {len(set(data))}\n")
 
@@ -149,16 +1027,293 @@ def sized():
 
     data = [new_ip() for _ in range(1_000_000)]
     print("For 1 million IP addresses:")
-    print(f"Size of set: {getsizeof(set(data)):3,} bytes")
+    print(f"Size of set: {deep_getsizeof(set(data)):13,} bytes")
+
+    for storage in ("list", "array", "packed"):
+        hll = HyperLogLog(storage=storage)
+        hll.ingest_many(data)
+        print(
+            f"Size of HLL ({storage}): {deep_getsizeof(hll):6,} bytes, estimate: {hll.estimate():,}"
+        )
+    print()
+
+    data = [new_ip() for _ in range(300)]
+    print("For 300 IP addresses:")
+    for sparse in (False, True):
+        hll = HyperLogLog(storage="array", sparse=sparse)
+        hll.ingest_many(data)
+        print(
+            f"Size of HLL ({sparse=}): {deep_getsizeof(hll):6,} bytes, estimate: {hll.estimate():,}"
+        )
+    print()
+
+    data = [new_ip() for _ in range(1_000_000)]
+    cpus = os.process_cpu_count() or 1
+    print(f"Parallel ingestion of 1 million IP addresses on {cpus} cores:")
+    single = HyperLogLog(Fnv1a64, storage="array")
+    single.ingest_many(data)
+    for workers in sorted({1, *(n for n in (2, 4, 8, 16, 32) if n < cpus), cpus}):
+        started_at = perf_counter()
+        hll = parallel_ingest(data, HyperLogLog(Fnv1a64, storage="array"), workers)
+        elapsed = perf_counter() - started_at
+        print(
+            f"{workers:3} workers: {len(data) / elapsed:12,.0f} keys/sec, "
+            f"same registers: {hll.registers == single.registers}"
+        )
+    print()
+
+
+def distributed() -> None:
+    """Build a sketch per shard, ship them as bytes and merge them centrally"""
+    data = ["".join([choice(ascii_letters) for _ in range(10)]) for _ in range(100_000)]
+    shards = [data[i::8] for i in range(8)]
+
+    payloads = []
+    for shard in shards:
+        hll = HyperLogLog(storage="array")
+        hll.ingest_many(shard)
+        payloads.append(hll.to_bytes())
+
+    merged = HyperLogLog.merge_all(HyperLogLog.from_bytes(p) for p in payloads)
+    whole = HyperLogLog(storage="array")
+    whole.ingest_many(data)
+
+    print(f"Merged {len(payloads)} sketches of {len(payloads[0]):,} bytes each")
+    print(f"Merged estimate: {merged.estimate():,}")
+    print(f"Real Unique: {len(set(data)):,}")
+    print(f"Same as one sketch: {merged.registers == whole.registers}\n")
 
-    hll = HyperLogLog()
 
+def benchmark() -> None:
+    """Compare the throughput of ingest() against ingest_many()"""
+    data = ["".join([choice(ascii_letters) for _ in range(10)]) for _ in range(200_000)]
+
+    single = HyperLogLog()
+    started_at = perf_counter()
     for d in data:
-        hll.ingest(d)
+        single.ingest(d)
+    single_elapsed = perf_counter() - started_at
 
-    print(f"Size of HLL: {getsizeof(hll):3,} bytes")
+    batch = HyperLogLog()
+    started_at = perf_counter()
+    batch.ingest_many(data)
+    batch_elapsed = perf_counter() - started_at
 
+    print(f"For {len(data):,} keys:")
+    print(f"ingest():      {len(data) / single_elapsed:12,.0f} keys/sec")
+    print(f"ingest_many(): {len(data) / batch_elapsed:12,.0f} keys/sec")
+    print(f"Speedup: {single_elapsed / batch_elapsed:.1f}x")
+    print(f"Same registers: {single.registers == batch.registers}")
 
-if __name__ == "__main__":
+    started_at = perf_counter()
+    for _ in range(1_000):
+        batch.estimate()
+    estimate_elapsed = (perf_counter() - started_at) / 1_000
+    print(f"estimate(): {estimate_elapsed * 1_000_000:.1f}us per call")
+    print(f"Consistent: {single.is_consistent() and batch.is_consistent()}\n")
+
+
+def benchmark_hashes() -> None:
+    """Compare the throughput and error of each hashing algorithm"""
+    data = ["".join([choice(ascii_letters) for _ in range(10)]) for _ in range(100_000)]
+    unique = len(set(data))
+    rows = []
+    for register_bits in range(4, 17, 2):
+        for name, algo in HASH_ALGOS.items():
+            hll = HyperLogLog(algo, register_bits, storage="array")
+            started_at = perf_counter()
+            hll.ingest_many(data)
+            elapsed = perf_counter() - started_at
+            error = abs(hll.estimate() - unique) / unique * 100
+            rows.append(
+                [register_bits, name, f"{len(data) / elapsed:,.0f}", f"{error:.2f}%"]
+            )
+
+    print(f"For {len(data):,} keys:")
+    print(tabulate(rows, headers=["Register bits", "Hash", "Keys/sec", "Error"]))
+    print()
+
+
+def benchmark_window() -> None:
+    """Show how query latency grows with the number of intervals in the window"""
+    rows = []
+    for interval_count in (1, 4, 16, 64, 256):
+        windowed = WindowedHyperLogLog(interval_count * 60, 60, storage="array")
+        data = [str(i) for i in range(interval_count * 1_000)]
+        for idx, keys in enumerate(batched(data, 1_000)):
+            windowed.ingest_many(keys, timestamp=idx * 60)
+        now = (interval_count - 1) * 60
+
+        started_at = perf_counter()
+        estimate = windowed.estimate(now)
+        first_query = perf_counter() - started_at
+
+        # Keep counting into the current interval between queries, which
+        # shouldn't invalidate the cached merge of the closed ones
+        cached_query = 0.0
+        for i in range(10):
+            windowed.ingest(f"new-{i}", timestamp=now)
+            started_at = perf_counter()
+            windowed.estimate(now)
+            cached_query += (perf_counter() - started_at) / 10
+
+        rows.append(
+            [
+                interval_count,
+                f"{first_query * 1_000:.2f}ms",
+                f"{cached_query * 1_000:.2f}ms",
+                f"{estimate:,}",
+                f"{len(data) + 10:,}",
+            ]
+        )
+
+    print("Windowed HyperLogLog query latency:")
+    print(
+        tabulate(
+            rows,
+            headers=["Intervals", "First query", "Cached query", "Estimate", "Real"],
+        )
+    )
+    print()
+
+
+def read_lines(stream: BinaryIO, chunk_size: int = 1 << 20) -> Iterator[list[bytes]]:
+    """Yields the lines of a stream in chunks of about chunk_size bytes"""
+    while lines := stream.readlines(chunk_size):
+        yield [line.rstrip(b"\r\n") for line in lines]
+
+
+def read_csv_field(stream: BinaryIO, field: str) -> Iterator[str]:
+    """
+    Yields one field from every row of a CSV stream.
+
+    If the field is a number it is used as the column index, otherwise the
+    first row is treated as a header and the field is looked up by name,
+    raising a LookupError if it isn't there. Rows too short to have the field
+    are skipped.
+    """
+    text = io.TextIOWrapper(stream, newline="")
+    try:
+        rows = csv.reader(text)
+        if field.isdigit():
+            column = int(field)
+        else:
+            header = next(rows, None)
+            if header is None:
+                return
+            if field not in header:
+                raise LookupError(f"CSV header has no field named {field!r}")
+            column = header.index(field)
+
+        for row in rows:
+            if len(row) > column:
+                yield row[column]
+    finally:
+        # Otherwise closing the wrapper would close the stream, even stdin
+        text.detach()
+
+
+def read_json_field(stream: BinaryIO, field: str) -> Iterator[str]:
+    """
+    Yields one field from every record of a JSON Lines stream.
+
+    Nested fields can be reached with dots, like "user.id". Records without
+    the field are skipped.
+    """
+    path = field.split(".")
+    for line in stream:
+        if not line.strip():
+            continue
+        value = json.loads(line)
+        for key in path:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            yield value if isinstance(value, str) else json.dumps(value)
+
+
+def count(args: argparse.Namespace) -> None:
+    """
+    Estimate the distinct lines or fields in files or stdin.
+
+    Everything is streamed through the sketch a chunk at a time, so memory
+    use stays the same however big the input is.
+    """
+    hll = HyperLogLog(HASH_ALGOS[args.hash], args.register_bits, storage="array")
+
+    for path in args.files:
+        if args.workers > 1 and path != "-" and not (args.csv_field or args.json_field):
+            parallel_ingest_file(path, hll, args.workers)
+            continue
+
+        with open(path, "rb") if path != "-" else nullcontext(stdin.buffer) as stream:
+            if args.csv_field:
+                try:
+                    hll.ingest_many(read_csv_field(stream, args.csv_field))
+                except LookupError as e:
+                    args.parser.error(f"{path}: {e}")
+            elif args.json_field:
+                hll.ingest_many(read_json_field(stream, args.json_field))
+            else:
+                for lines in read_lines(stream):
+                    hll._ingest_encoded(lines)
+
+    print(hll.estimate())
+
+
+def demo(args: argparse.Namespace) -> None:
     test()
     sized()
+    distributed()
+    benchmark()
+    benchmark_hashes()
+    benchmark_window()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="hyper_log_log",
+        description="Estimate the number of distinct values with HyperLogLog",
+    )
+    parser.set_defaults(func=demo)
+    commands = parser.add_subparsers()
+
+    demo_parser = commands.add_parser(
+        "demo", help="Run the accuracy, size and speed demos (the default)"
+    )
+    demo_parser.set_defaults(func=demo)
+
+    count_parser = commands.add_parser(
+        "count", help="Estimate the distinct lines or fields in files or stdin"
+    )
+    count_parser.set_defaults(func=count, parser=count_parser)
+    count_parser.add_argument(
+        "files", nargs="*", default=["-"], help="Files to read, - for stdin"
+    )
+    field = count_parser.add_mutually_exclusive_group()
+    field.add_argument(
+        "--csv-field", help="Count a CSV column, by header name or index"
+    )
+    field.add_argument(
+        "--json-field", help="Count a JSON Lines field, with dots for nested fields"
+    )
+    count_parser.add_argument(
+        "--register-bits", type=int, default=14, help="Default: %(default)s"
+    )
+    count_parser.add_argument(
+        "--hash", choices=HASH_ALGOS, default="fnv1a64", help="Default: %(default)s"
+    )
+    count_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes to read each file with, only used for plain lines",
+    )
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
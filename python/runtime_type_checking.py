@@ -1,4 +1,28 @@
-from typing import Callable, get_type_hints
+import functools
+import inspect
+import os
+import types
+from collections import Counter
+from collections.abc import Callable, Collection, Iterable, Mapping, Sequence
+from itertools import islice
+from random import random, randrange
+from timeit import timeit
+from typing import (
+    Annotated,
+    Any,
+    Literal,
+    LiteralString,
+    NewType,
+    Protocol,
+    TypeVar,
+    Union,
+    get_args,
+    get_origin,
+    get_protocol_members,
+    get_type_hints,
+    is_protocol,
+    is_typeddict,
+)
 
 
 def typechecked_call[**P, T](c: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
@@ -63,3 +87,328 @@ try:
     typechecked_call(hello, name="Matt", age=False)
 except TypeError as e:
     print(e)
+
+
+"""
+typechecked_call() calls get_type_hints() every time, which re-evaluates the
+annotations, and compares exact types so it can't handle subclasses, unions
+or generics. The @typechecked decorator below does the expensive work once:
+the first call resolves the hints and compiles each one into a validator
+function, and works out which validator goes with which position or keyword.
+After that a call is just the validators and the function itself.
+"""
+
+
+def _sampled(v: Collection, sample: int | None) -> Iterable:
+    """
+    All of v, or sample items of it if it is bigger than that: random ones
+    from sequences, and the first ones from anything else.
+    """
+    if sample is None or len(v) <= sample:
+        return v
+    if isinstance(v, Sequence):
+        return (v[randrange(len(v))] for _ in range(sample))
+    return islice(v, sample)
+
+
+def _check_items(
+    container: type, item: Callable[[Any], bool], sample: int | None
+) -> Callable:
+    return lambda v: (
+        isinstance(v, container) and all(item(i) for i in _sampled(v, sample))
+    )
+
+
+# int is accepted where float is expected and both where complex is (PEP 484)
+_NUMERIC = {float: (int, float), complex: (int, float, complex)}
+
+
+def _classes(hints: Iterable[type]) -> tuple[type, ...]:
+    return tuple(c for hint in hints for c in _NUMERIC.get(hint, (hint,)))
+
+
+@functools.cache
+def compile_validator(hint: Any, sample: int | None = None) -> Callable[[Any], bool]:
+    """
+    Return a function that says whether a value matches the type hint.
+
+    Handles plain and generic classes, unions (including X | None), Literal,
+    Protocol (runtime checkable or not), Annotated and the usual containers,
+    checking every item of lists, sets, tuples and dicts, or only sample of
+    them if sample is given. NewTypes are checked as the type they wrap and
+    TypedDicts as dicts, and other special forms like Self and Never, which
+    can't be checked from the value alone, accept anything. Anything else just
+    has its origin class checked. Validators are cached per hint, so functions
+    that share annotations share validators.
+    """
+    if hint is Any or isinstance(hint, TypeVar):
+        return lambda v: True
+    if hint is None or hint is types.NoneType:
+        return lambda v: v is None
+    if isinstance(hint, NewType):
+        return compile_validator(hint.__supertype__, sample)
+    if is_typeddict(hint):
+        return lambda v: isinstance(v, dict)
+    if hint is LiteralString:
+        return lambda v: isinstance(v, str)
+
+    origin, args = get_origin(hint), get_args(hint)
+    if origin is Annotated:
+        return compile_validator(args[0], sample)
+    if origin is Literal:
+        # Compare types too, otherwise True would match Literal[1]
+        allowed = {(type(a), a) for a in args}
+
+        def check_literal(v: Any) -> bool:
+            try:
+                return (type(v), v) in allowed
+            except TypeError:
+                # Unhashable, so it can't be one of the allowed values
+                return False
+
+        return check_literal
+    if origin in (Union, types.UnionType):
+        if all(
+            isinstance(a, type) and not is_protocol(a) and not is_typeddict(a)
+            for a in args
+        ):
+            classes = _classes(args)
+            return lambda v: isinstance(v, classes)
+        options = [compile_validator(a, sample) for a in args]
+        return lambda v: any(check(v) for check in options)
+    if isinstance(hint, type) and is_protocol(hint):
+        members = get_protocol_members(hint)
+        return lambda v: all(hasattr(v, m) for m in members)
+    if origin is Callable:
+        return callable
+
+    if origin is None:
+        if not isinstance(hint, type):
+            return lambda v: True
+        classes = _classes((hint,))
+        return lambda v: isinstance(v, classes)
+    if not isinstance(origin, type):
+        # ClassVar[int], Unpack[Ts] and the like
+        return lambda v: True
+    if not args:
+        return lambda v: isinstance(v, origin)
+    if origin is tuple:
+        if len(args) == 2 and args[1] is Ellipsis:
+            return _check_items(tuple, compile_validator(args[0], sample), sample)
+        items = [compile_validator(a, sample) for a in args]
+        return lambda v: (
+            isinstance(v, tuple)
+            and len(v) == len(items)
+            and all(check(i) for check, i in zip(items, v))
+        )
+    if issubclass(origin, Mapping) and len(args) == 2:
+        key = compile_validator(args[0], sample)
+        value = compile_validator(args[1], sample)
+        return lambda v: (
+            isinstance(v, origin)
+            and all(key(k) and value(i) for k, i in _sampled(v.items(), sample))
+        )
+    if issubclass(origin, (list, set, frozenset, Sequence)):
+        return _check_items(origin, compile_validator(args[0], sample), sample)
+    return lambda v: isinstance(v, origin)
+
+
+def _compile_signature(
+    c: Callable, sample: int | None = None
+) -> tuple[list, dict, Any, Any]:
+    """
+    Pair up the parameters of c with validators for their annotations:
+    one per position, one per keyword, and one each for *args and **kwargs.
+    Unannotated parameters get None.
+    """
+    hints = get_type_hints(c)
+    positional, keyword = [], {}
+    var_args = var_kwargs = None
+    for name, param in inspect.signature(c).parameters.items():
+        check = compile_validator(hints[name], sample) if name in hints else None
+        check = check and (check, name, hints[name])
+        match param.kind:
+            case param.POSITIONAL_ONLY:
+                positional.append(check)
+            case param.POSITIONAL_OR_KEYWORD:
+                positional.append(check)
+                keyword[name] = check
+            case param.KEYWORD_ONLY:
+                keyword[name] = check
+            case param.VAR_POSITIONAL:
+                var_args = check
+            case param.VAR_KEYWORD:
+                var_kwargs = check
+    return positional, keyword, var_args, var_kwargs
+
+
+def _find_violations(compiled: tuple, args: tuple, kwargs: dict) -> list | None:
+    """Return (name, hint, value) for each argument that fails its check"""
+    positional, keyword, var_args, var_kwargs = compiled
+    found = None
+    for check, value in zip(positional, args):
+        if check and not check[0](value):
+            found = (found or []) + [(check[1], check[2], value)]
+    if var_args and len(args) > len(positional):
+        for value in args[len(positional) :]:
+            if not var_args[0](value):
+                found = (found or []) + [(var_args[1], var_args[2], value)]
+    for key, value in kwargs.items():
+        check = keyword.get(key, var_kwargs)
+        if check and not check[0](value):
+            found = (found or []) + [(key, check[2], value)]
+    return found
+
+
+def _fail(name: str, hint: Any, value: Any):
+    raise TypeError(
+        f"Argument '{value}' of type {type(value)} does not match type "
+        f"annotation for argument '{name}' of type {hint}"
+    )
+
+
+# Set to 1 to have @typechecked return functions undecorated
+DISABLE_ENV_VAR = "DISABLE_TYPECHECKING"
+
+# Violations counted by @typechecked(raise_errors=False), by module, function
+# and argument
+violations: Counter[str] = Counter()
+
+
+def typechecked[**P, T](
+    c: Callable[P, T] | None = None,
+    *,
+    first: int | None = None,
+    rate: float | None = None,
+    sample: int | None = None,
+    raise_errors: bool = True,
+) -> Callable[P, T]:
+    """
+    Decorator version of typechecked_call(), which raises a TypeError when an
+    argument doesn't match its annotation.
+
+    The hints are resolved on the first call rather than here so that
+    annotations can refer to classes defined after the function.
+
+    By default every call is checked. To keep checks on in hot code, first
+    only checks the first that many calls, rate only checks that fraction of
+    calls at random, and sample only checks that many items of each
+    container. With raise_errors=False failures are added to violations
+    rather than raised. If DISABLE_TYPECHECKING=1 is set the function is
+    returned as it is, so the checks cost nothing at all.
+    """
+    if c is None:
+        return functools.partial(
+            typechecked,
+            first=first,
+            rate=rate,
+            sample=sample,
+            raise_errors=raise_errors,
+        )
+    if os.environ.get(DISABLE_ENV_VAR) == "1":
+        return c
+
+    compiled = None
+    calls = 0
+
+    @functools.wraps(c)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        nonlocal compiled, calls
+        if first is not None:
+            calls += 1
+            if calls > first:
+                return c(*args, **kwargs)
+        if rate is not None and random() >= rate:
+            return c(*args, **kwargs)
+
+        if compiled is None:
+            compiled = _compile_signature(c, sample)
+        if found := _find_violations(compiled, args, kwargs):
+            if raise_errors:
+                _fail(*found[0])
+            for name, _, _ in found:
+                violations[f"{c.__module__}.{c.__qualname__}({name})"] += 1
+
+        return c(*args, **kwargs)
+
+    return wrapper
+
+
+def report_violations():
+    for name, count in violations.most_common():
+        print(f"{name}: {count} type violations")
+
+
+class Named(Protocol):
+    name: str
+
+
+@typechecked
+def checked_add(a: int, b: int) -> int:
+    return a + b
+
+
+@typechecked
+def greet(
+    who: Named | str,
+    times: list[int] | None = None,
+    mood: Literal["happy", "sad"] = "happy",
+) -> str:
+    name = who if isinstance(who, str) else who.name
+    return f"Hello {name} ({mood}) x{sum(times or [1])}"
+
+
+class Person:
+    def __init__(self, name: str):
+        self.name = name
+
+
+# Subclasses, unions, generics, Literal and Protocol all work
+print(greet(Person("Matt"), [1, 2], mood="sad"))
+print(greet("Matt", times=None))
+
+# These will fail
+for call in (
+    lambda: checked_add(1, "2"),
+    lambda: greet("Matt", [1, "2"]),
+    lambda: greet("Matt", mood="angry"),
+    lambda: greet(42),
+):
+    try:
+        call()
+    except TypeError as e:
+        print(e)
+
+
+# Count failures instead of raising, and only look at some of a big list
+@typechecked(rate=0.5, sample=10, raise_errors=False)
+def describe(values: list[int], label: str = "values") -> str:
+    return f"{len(values)} {label}"
+
+
+for i in range(100):
+    describe([1, "2"] * 500 if i % 2 else list(range(1000)), label=i)
+report_violations()
+
+
+def benchmark(number: int = 200_000):
+    """
+    Time a call to add() plainly, through typechecked_call(), decorated and
+    decorated with sampling
+    """
+    calls = {
+        "plain": lambda: add(1, 2),
+        "typechecked_call": lambda: typechecked_call(add, 1, 2),
+    }
+    policies = {"always": {}, "first=100": {"first": 100}, "rate=0.01": {"rate": 0.01}}
+    for policy, options in policies.items():
+        checked = typechecked(add, **options)
+        calls[f"@typechecked {policy}"] = lambda checked=checked: checked(1, 2)
+
+    for name, call in calls.items():
+        elapsed = timeit(call, number=number)
+        print(f"{name}: {elapsed / number * 1e9:.0f}ns per call")
+
+
+if __name__ == "__main__":
+    benchmark()
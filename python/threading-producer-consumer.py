@@ -1,9 +1,12 @@
+from collections.abc import Callable
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from queue import Queue
+from queue import Empty, Full, Queue
 from random import randint
 from sys import stdout
-from threading import Thread
-from time import sleep
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+from typing import Any, Literal
 
 from loguru import logger as log
 
@@ -40,6 +43,18 @@ def producer(queue: Queue):
         sleep(get_wait_sec())
 
 
+def fetch_tasks(pool: "ConsumerPool", tick: datetime):
+    """One run of producer(), for a MinuteScheduler feeding a ConsumerPool"""
+    log.info(f"Fetching tasks for {tick.strftime('%H:%M:%S')}")
+    sleep(randint(1, 3))
+    tasks = [randint(1, 3) for i in range(randint(1, 5))]
+    log.info(f"Fetched {len(tasks)} tasks")
+    for t in tasks:
+        pool.put(t)
+        log.info(f"Added task {t} to queue")
+    log.info(f"Stats: {pool.stats()}")
+
+
 def consumer(queue: Queue):
     log.info("Running")
     # consume items
@@ -51,16 +66,224 @@ def consumer(queue: Queue):
         log.info(f"Queue size: {queue.qsize()}")
 
 
-# create the shared queue
-queue = Queue()
-# start the consumer
-consumer_t = Thread(target=consumer, args=(queue,))
-consumer_t.start()
+# Marks the end of the queue, one is put on for each consumer at shutdown
+STOP = object()
+
+
+@dataclass
+class PoolStats:
+    started_at: float = field(default_factory=monotonic)
+    processed: int = 0
+    failed: int = 0
+    batches: int = 0
+    wait_sec: float = 0.0
+
+
+class ConsumerPool:
+    """
+    A pool of consumer threads on a bounded queue.
+
+    put() blocks while the queue holds maxsize items, so a fast producer is
+    slowed down to what the consumers can handle instead of growing the queue
+    without limit. Each consumer takes a batch of up to batch_size items,
+    waiting at most batch_timeout seconds after the first one for the batch to
+    fill, and passes it to handler. If handler raises, the error is logged,
+    the batch's items are counted as failed and the consumer carries on.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[list], None],
+        workers: int = 4,
+        maxsize: int = 100,
+        batch_size: int = 10,
+        batch_timeout: float = 0.1,
+    ):
+        self.handler = handler
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.queue = Queue(maxsize)
+        self._stats = PoolStats()
+        self._lock = Lock()
+        self._threads = [
+            Thread(target=self._consume, name=f"consumer-{i}") for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def put(self, item: Any, timeout: float | None = None):
+        """Add an item, blocking for up to timeout seconds while the queue is full"""
+        self.queue.put((monotonic(), item), timeout=timeout)
+
+    def _next_batch(self) -> tuple[list, bool]:
+        """Return the next batch and whether the STOP marker was reached"""
+        batch = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            try:
+                if deadline is None:
+                    entry = self.queue.get()
+                    deadline = monotonic() + self.batch_timeout
+                else:
+                    entry = self.queue.get(timeout=max(0, deadline - monotonic()))
+            except Empty:
+                break
+            if entry is STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _consume(self):
+        log.info("Running")
+        stopped = False
+        while not stopped:
+            batch, stopped = self._next_batch()
+            if not batch:
+                continue
+            now = monotonic()
+            wait_sec = sum(now - queued_at for queued_at, _ in batch)
+            try:
+                self.handler([item for _, item in batch])
+                failed = False
+            except Exception:
+                log.exception(f"Handler failed on a batch of {len(batch)} items")
+                failed = True
+            with self._lock:
+                if failed:
+                    self._stats.failed += len(batch)
+                else:
+                    self._stats.processed += len(batch)
+                self._stats.batches += 1
+                self._stats.wait_sec += wait_sec
+        log.info("Stopped")
+
+    def stats(self) -> dict:
+        """Numbers to tune workers and batch_size by"""
+        with self._lock:
+            stats = self._stats
+            processed = stats.processed
+            handled = processed + stats.failed
+            return {
+                "queue_depth": self.queue.qsize(),
+                "processed": processed,
+                "failed": stats.failed,
+                "avg_batch_size": handled / stats.batches if stats.batches else 0,
+                "avg_wait_sec": stats.wait_sec / handled if handled else 0,
+                "throughput": processed / (monotonic() - stats.started_at),
+            }
+
+    def shutdown(self, drain: bool = True):
+        """
+        Stop the consumers and wait for them to exit. With drain the items
+        already queued are processed first, otherwise they are thrown away.
+        """
+        if not drain:
+            try:
+                while True:
+                    self.queue.get_nowait()
+            except Empty:
+                pass
+        # A full queue with no consumers left to empty it would block forever
+        stops = len(self._threads)
+        while stops and any(t.is_alive() for t in self._threads):
+            try:
+                self.queue.put(STOP, timeout=0.1)
+                stops -= 1
+            except Full:
+                pass
+        for t in self._threads:
+            t.join()
+
+
+type Overlap = Literal["skip", "queue", "parallel"]
+
+
+class MinuteScheduler:
+    """
+    Calls job(tick) in a new thread at the start of every minute.
 
-# start the producer
-producer_t = Thread(target=producer, args=(queue,))
+    producer() sleeps for get_wait_sec() after each fetch, so a slow fetch
+    pushes the next one back and a fetch longer than the rest of the minute
+    misses a tick. Here only the first deadline comes from get_wait_sec(),
+    the rest are exactly a minute apart on the monotonic clock, and the job
+    runs off the scheduling thread so it can't delay it.
+
+    overlap decides what happens when a tick comes round while the previous
+    run is still going: "skip" drops the tick, "queue" runs it once the
+    previous one finishes and "parallel" runs it straight away. Dropped ticks,
+    and any that passed while the scheduler itself was held up, are added to
+    missed.
+    """
+
+    interval = 60.0
+
+    def __init__(self, job: Callable[[datetime], None], overlap: Overlap = "skip"):
+        self.job = job
+        self.overlap = overlap
+        self.missed: list[datetime] = []
+        self._running: list[Thread] = []
+
+    def run(self, stop: Event):
+        """Schedule ticks until stop is set, then wait for running jobs"""
+        log.info("Running")
+        deadline = monotonic() + get_wait_sec()
+        while not stop.wait(max(0, deadline - monotonic())):
+            tick = datetime.now().replace(second=0, microsecond=0)
+            late_ticks = int((monotonic() - deadline) // self.interval)
+            for i in range(late_ticks, 0, -1):
+                self._miss(tick - timedelta(minutes=i), "scheduler was held up")
+            deadline += (late_ticks + 1) * self.interval
+            self._fire(tick)
+
+        for t in self._running:
+            t.join()
+        log.info("Stopped")
+
+    def _miss(self, tick: datetime, reason: str):
+        log.warning(f"Missed tick {tick.strftime('%H:%M')}, {reason}")
+        self.missed.append(tick)
+
+    def _fire(self, tick: datetime):
+        self._running = [t for t in self._running if t.is_alive()]
+        target, args = self.job, (tick,)
+        if self._running and self.overlap == "skip":
+            self._miss(tick, "previous run is still going")
+            return
+        if self._running and self.overlap == "queue":
+            target, args = self._run_after, (self._running[-1], tick)
+
+        t = Thread(target=target, args=args, name=f"tick-{tick:%H:%M}")
+        t.start()
+        self._running.append(t)
+
+    def _run_after(self, previous: Thread, tick: datetime):
+        previous.join()
+        self.job(tick)
+
+
+def handle_batch(batch: list):
+    log.info(f"Processing batch {batch}")
+    for item in batch:
+        sleep(item)
+    log.info(f"Processed batch {batch}")
+
+
+pool = ConsumerPool(
+    handle_batch, workers=3, maxsize=10, batch_size=4, batch_timeout=0.5
+)
+
+# fetch tasks every minute, until Ctrl-C
+scheduler = MinuteScheduler(lambda tick: fetch_tasks(pool, tick), overlap="parallel")
+stop = Event()
+producer_t = Thread(target=scheduler.run, args=(stop,))
 producer_t.start()
 
-# wait for all threads to finish
-producer_t.join()
-consumer_t.join()
+try:
+    producer_t.join()
+except KeyboardInterrupt:
+    stop.set()
+    producer_t.join()
+
+# let the consumers finish what is queued
+pool.shutdown(drain=True)
+log.info(f"Stats: {pool.stats()}, missed ticks: {len(scheduler.missed)}")